@@ -0,0 +1,273 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+import pickle
+import queue
+import threading
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Dict, List
+
+from exporter import Paragraph, ParagraphAssembler, Section, Speaker
+from main import convert_file
+from miner import Line, iter_transcript_pages
+from textreader import ReadTextTranscript, is_text_transcript
+
+logger = logging.getLogger(__name__)
+
+
+# Put on the queue after the last page
+_DONE = None
+
+
+def _produce_pages(file_path: Path, options: dict, pages: queue.Queue, stop):
+    """
+    Runs in a worker process, so mining does not hold the event loop's GIL.
+    Puts the lines of each page on the (multiprocessing) queue, until the
+    last page or until stop is set.
+    """
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                # Check again if the consumer went away
+                continue
+        return False
+
+    try:
+        if is_text_transcript(file_path):
+            with open(file_path, "r", encoding="utf-8", errors="replace") as text_document:
+                put(ReadTextTranscript(text_document))
+        else:
+            with open(file_path, "rb") as document:
+                for page_lines in iter_transcript_pages(document, **options):
+                    if stop.is_set() or not put(page_lines):
+                        logger.info(f"Stopped reading {file_path.name}")
+                        return
+        put(_DONE)
+    except Exception as err:
+        try:
+            pickle.dumps(err)
+        except Exception:
+            # Not every exception can be sent back to the consumer
+            err = RuntimeError(f"{type(err).__name__}: {err}")
+        put(err)
+
+
+def _next_page(pages: queue.Queue, producer: concurrent.futures.Future):
+    """
+    Runs in a thread of the consumer. Waits for the next item on the queue,
+    without holding the GIL.
+    """
+    while True:
+        try:
+            return pages.get(timeout=0.5)
+        except queue.Empty:
+            if producer.done():
+                # The worker is gone without putting anything else
+                try:
+                    return pages.get_nowait()
+                except queue.Empty:
+                    err = producer.exception()
+                    return err or RuntimeError("Transcript worker stopped without finishing.")
+
+
+class TranscriptConverter(object):
+    """
+    Converts transcripts from asyncio code without blocking the event loop.
+
+    Whole file conversions run on an executor (a process pool by default),
+    and at most max_concurrency conversions run at once. Cancelling a
+    conversion that has not started drops it. A running conversion
+    finishes in its worker process, but its result is discarded.
+
+    Streamed transcripts are mined on the same executor, and their pages
+    are passed back through a multiprocessing queue.
+    """
+
+    def __init__(self, max_concurrency: int = 4, executor: Executor | None = None):
+        self._owns_executor = executor is None
+        self.executor = executor or ProcessPoolExecutor(
+            max_workers=max_concurrency)
+        # Waits on the page queues, so the event loop never blocks on them
+        self._threads = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="transcript")
+        self._limit = asyncio.Semaphore(max_concurrency)
+        # Started on first use. Its queues and events can be passed to
+        # the workers of a process pool.
+        self._manager = None
+        self._manager_lock = threading.Lock()
+
+    def _open_pages_queue(self, queue_pages: int):
+        """
+        Runs in a thread, as starting the manager process, and creating
+        its queues and events, blocks until the manager answers.
+        """
+        with self._manager_lock:
+            if self._manager is None:
+                self._manager = multiprocessing.Manager()
+            return self._manager.Queue(maxsize=queue_pages), self._manager.Event()
+
+    async def convert_file(self, file_path: Path, **options):
+        """
+        Async convert_file. options are passed to convert_file.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._limit:
+            await loop.run_in_executor(
+                self.executor, functools.partial(convert_file, file_path, **options))
+
+    async def iter_paragraphs(self,
+                              file_path: Path,
+                              sections: List[Section] | None = None,
+                              speakers: Dict[str, Speaker] | None = None,
+                              analyze_pages: int = 10,
+                              queue_pages: int = 4,
+                              **options) -> AsyncIterator[Paragraph]:
+        """
+        Yields the paragraphs of a transcript as its pages are mined.
+
+        The start positions used to tell new paragraphs from continuation
+        lines are analyzed from the first analyze_pages pages, instead of
+        the whole transcript. At most queue_pages mined pages wait for the
+        consumer. Breaking out of the loop, or cancelling the task, stops
+        the mining after the current page. options are passed to
+        iter_transcript_pages, ie. the margins.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._limit:
+            pages, stop = await loop.run_in_executor(
+                self._threads, self._open_pages_queue, queue_pages)
+            producer = None
+
+            try:
+                # The first submit starts the worker processes, so it is
+                # made from a thread as well
+                producer = await loop.run_in_executor(
+                    self._threads, functools.partial(
+                        self.executor.submit, _produce_pages, file_path, options, pages, stop))
+
+                assembler = None
+                buffered: List[Line] = list()
+                pages_read = 0
+
+                while True:
+                    item = await loop.run_in_executor(self._threads, _next_page, pages, producer)
+                    if item is _DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+
+                    if assembler:
+                        lines = item
+                    else:
+                        buffered.extend(item)
+                        pages_read += 1
+                        if pages_read < analyze_pages:
+                            continue
+
+                        assembler = ParagraphAssembler.from_lines(
+                            buffered, sections=sections, speakers=speakers)
+                        lines, buffered = buffered, list()
+
+                    for l in lines:
+                        finished = assembler.add_line(l)
+                        if finished:
+                            yield finished
+
+                if assembler is None:
+                    if not buffered:
+                        return
+                    # Shorter than analyze_pages
+                    assembler = ParagraphAssembler.from_lines(
+                        buffered, sections=sections, speakers=speakers)
+                    for l in buffered:
+                        finished = assembler.add_line(l)
+                        if finished:
+                            yield finished
+
+                last = assembler.finish()
+                if last:
+                    yield last
+
+            finally:
+                # Let the worker see it should stop, and unblock it
+                if producer:
+                    producer.cancel()
+                stop.set()
+
+    def close(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        with self._manager_lock:
+            if self._manager is not None:
+                self._manager.shutdown()
+                self._manager = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+
+# One default converter per event loop, with the task that closes it
+_default_converters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, TranscriptConverter]" = weakref.WeakKeyDictionary()
+_closing_tasks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task]" = weakref.WeakKeyDictionary()
+
+
+async def _close_on_shutdown(loop: asyncio.AbstractEventLoop, converter: TranscriptConverter):
+    """
+    Waits until cancelled, then closes the default converter of the loop.
+    asyncio.run cancels the tasks left when the main coroutine returns, so
+    the process pool and manager process do not outlive the loop.
+    """
+    try:
+        await loop.create_future()
+    finally:
+        _default_converters.pop(loop, None)
+        _closing_tasks.pop(loop, None)
+        converter.close()
+
+
+def _default_converter() -> TranscriptConverter:
+    """
+    The converter used when none is given. It is closed when the loop
+    shuts down. A loop that is not run with asyncio.run must cancel its
+    remaining tasks before closing (as asyncio.run does), or the default
+    converter's workers are left running.
+    """
+    loop = asyncio.get_running_loop()
+    converter = _default_converters.get(loop)
+    if converter is None:
+        converter = TranscriptConverter()
+        _default_converters[loop] = converter
+        # The loop only keeps a weak reference to its tasks
+        _closing_tasks[loop] = loop.create_task(
+            _close_on_shutdown(loop, converter))
+    return converter
+
+
+async def convert_file_async(file_path: Path, converter: TranscriptConverter | None = None, **options):
+    """
+    Convert a transcript without blocking the event loop.
+    See TranscriptConverter.convert_file.
+    """
+    converter = converter or _default_converter()
+    await converter.convert_file(file_path, **options)
+
+
+def iter_paragraphs_async(file_path: Path, converter: TranscriptConverter | None = None, **options) -> AsyncIterator[Paragraph]:
+    """
+    Yields the paragraphs of a transcript as its pages are mined.
+    See TranscriptConverter.iter_paragraphs.
+    """
+    converter = converter or _default_converter()
+    return converter.iter_paragraphs(file_path, **options)
@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import re
+import sys
+import warnings
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+segment_regex = re.compile(r"^segment-(\d+)\.zip$")
+
+
+def _fsync_directory(path: Path):
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class TranscriptArchive(object):
+    """
+    An archive holding the outputs of a batch of transcripts, instead of
+    thousands of small files next to the PDFs.
+
+    The archive is a directory of zip segments and a manifest listing the
+    members of each segment. A batch writes its members into a new
+    segment, each with a single bulk write through a large buffer. On
+    close the segment is synced to disk once, and the manifest is
+    atomically replaced to include it. Existing segments are never copied
+    or rewritten, and a batch that is killed part way leaves the archive
+    as it was.
+
+    A member added again supersedes the earlier one. compact() rewrites the
+    live members into a single segment, dropping superseded members.
+
+    With read_only, the archive cannot be added to.
+    """
+
+    def __init__(self, path: Path, buffer_size: int = 1024 * 1024, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self.buffer_size = buffer_size
+
+        manifest_file = path / MANIFEST
+        if manifest_file.is_file():
+            with open(manifest_file, "r", encoding="utf-8") as file:
+                self._segments: List[dict] = json.load(file)["segments"]
+        elif read_only or (path.exists() and not path.is_dir()):
+            raise FileNotFoundError(f"Not a transcript archive: {path}")
+        else:
+            self._segments = list()
+
+        # member name: segment file. Later segments supersede earlier ones.
+        self._members: Dict[str, str] = dict()
+        for segment in self._segments:
+            for name in segment["members"]:
+                self._members[name] = segment["file"]
+
+        self._readers: Dict[str, zipfile.ZipFile] = dict()
+        # The segment being written by this batch, opened on the first add
+        self._segment: dict | None = None
+        self._segment_file = None
+        self._writer: zipfile.ZipFile | None = None
+
+        if not read_only:
+            path.mkdir(parents=True, exist_ok=True)
+            self._remove_stale_segments()
+
+    def _remove_stale_segments(self):
+        """
+        Remove segments of batches that never finished, which are not in
+        the manifest.
+        """
+        listed = {segment["file"] for segment in self._segments}
+        for p in self.path.iterdir():
+            if segment_regex.search(p.name) and p.name not in listed:
+                logger.warning(f"Removing unfinished archive segment: {p.name}")
+                p.unlink()
+
+    def _next_segment_name(self) -> str:
+        numbers = [int(segment_regex.search(p.name).group(1))
+                   for p in self.path.iterdir() if segment_regex.search(p.name)]
+        return f"segment-{max(numbers, default=0) + 1:05d}.zip"
+
+    def _open_segment(self):
+        name = self._next_segment_name()
+        self._segment = {"file": name, "members": list()}
+        self._segment_file = open(
+            self.path / name, "w+b", buffering=self.buffer_size)
+        self._writer = zipfile.ZipFile(
+            self._segment_file, mode="w", compression=zipfile.ZIP_DEFLATED)
+
+    def _finish_segment(self):
+        """
+        Sync the segment being written, and add it to the manifest.
+        """
+        if self._writer is None:
+            return
+
+        self._writer.close()
+        self._segment_file.flush()
+        os.fsync(self._segment_file.fileno())
+        self._segment_file.close()
+        self._writer = None
+
+        self._segments.append(self._segment)
+        self._segment = None
+        self._write_manifest()
+
+    def _write_manifest(self):
+        tmp_file = self.path / f"{MANIFEST}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as file:
+            json.dump({"version": MANIFEST_VERSION, "segments": self._segments}, file)
+            file.flush()
+            os.fsync(file.fileno())
+
+        # Atomically replace the manifest, and make the rename durable
+        os.replace(tmp_file, self.path / MANIFEST)
+        _fsync_directory(self.path)
+
+    def add(self, name: str, data: bytes):
+        """
+        Add a member to the archive. A member with the same name as an
+        existing member supersedes it.
+        """
+        if self.read_only:
+            raise ValueError(f"Archive is read only: {self.path}")
+
+        if name in self._members:
+            logger.warning(f"Superseding existing archive member: {name}")
+
+        if self._writer is None:
+            self._open_segment()
+
+        with warnings.catch_warnings():
+            # zipfile warns about duplicate names in a segment. The last
+            # one is the one that is read.
+            warnings.simplefilter("ignore", UserWarning)
+            self._writer.writestr(name, data)
+
+        if name not in self._segment["members"]:
+            self._segment["members"].append(name)
+        self._members[name] = self._segment["file"]
+        logger.debug(f"Archived {name} ({len(data)} bytes)")
+
+    def names(self) -> List[str]:
+        return sorted(self._members)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._members
+
+    def read(self, name: str) -> bytes:
+        segment = self._members[name]
+        if self._segment and segment == self._segment["file"]:
+            return self._writer.read(name)
+
+        reader = self._readers.get(segment)
+        if reader is None:
+            reader = zipfile.ZipFile(self.path / segment, mode="r")
+            self._readers[segment] = reader
+        return reader.read(name)
+
+    def extract(self, name: str, dest: Path) -> Path:
+        """
+        Materialize a single member as a file under dest.
+        """
+        # Read first, so a missing member does not leave an empty file
+        data = self.read(name)
+
+        member_path = dest.joinpath(*PurePosixPath(name).parts)
+        member_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(member_path, "wb") as file:
+            file.write(data)
+
+        logger.info(f"Extracted {name} to {member_path}")
+        return member_path
+
+    def compact(self):
+        """
+        Rewrite the live members into a single segment, dropping the
+        members that were superseded, and remove the old segments.
+        """
+        if self.read_only:
+            raise ValueError(f"Archive is read only: {self.path}")
+
+        self._finish_segment()
+        old_segments = [segment["file"] for segment in self._segments]
+        if len(old_segments) <= 1 and not self._has_superseded():
+            logger.info("Archive is already compact.")
+            return
+
+        self._open_segment()
+        for name in sorted(self._members):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", UserWarning)
+                self._writer.writestr(name, self.read(name))
+            self._segment["members"].append(name)
+
+        # Only the new segment is in the manifest once it is finished
+        self._segments = list()
+        self._finish_segment()
+        self._members = {name: self._segments[0]["file"]
+                         for name in self._segments[0]["members"]}
+
+        self._close_readers()
+        for segment in old_segments:
+            (self.path / segment).unlink()
+
+        logger.info(
+            f"Compacted {len(old_segments)} segments into {self._segments[0]['file']}")
+
+    def _has_superseded(self) -> bool:
+        listed = sum(len(segment["members"]) for segment in self._segments)
+        return listed > len(self._members)
+
+    def _close_readers(self):
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = dict()
+
+    def close(self):
+        if not self.read_only:
+            self._finish_segment()
+        self._close_readers()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="Transcript Archive",
+        description="List, extract or compact converted transcripts in a batch archive.",
+    )
+    parser.add_argument("archive", help="A path to a transcript archive directory.")
+    parser.add_argument(
+        "names",
+        nargs="*",
+        help="Members to extract, ie. depo.txt. Lists the archive if none are given.",
+    )
+    parser.add_argument(
+        "-o", "--output",
+        default=".",
+        help="Directory to extract members into. The default is the current directory.",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Rewrite the archive into a single segment, dropping superseded members.",
+    )
+    args = parser.parse_args()
+
+    archive_path = Path(args.archive)
+
+    try:
+        archive = TranscriptArchive(archive_path, read_only=not args.compact)
+    except (FileNotFoundError, json.JSONDecodeError, KeyError) as err:
+        print(f"Not a valid archive: {archive_path} ({err})", file=sys.stderr)
+        sys.exit(1)
+
+    failed = False
+    with archive:
+        try:
+            if args.compact:
+                archive.compact()
+            elif not args.names:
+                for name in archive.names():
+                    print(name)
+            else:
+                for name in args.names:
+                    try:
+                        print(archive.extract(name, Path(args.output)))
+                    except KeyError:
+                        print(f"Not in archive: {name}", file=sys.stderr)
+                        failed = True
+        except (zipfile.BadZipFile, FileNotFoundError) as err:
+            print(f"Damaged archive segment in {archive_path}: {err}", file=sys.stderr)
+            failed = True
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,208 @@
+import logging
+import re
+import struct
+import sys
+from pathlib import Path
+from typing import IO, List, Tuple
+
+from exporter import Paragraph
+
+logger = logging.getLogger(__name__)
+
+
+# The offset index is a small header followed by fixed size records,
+# sorted by (page, line_number), so a citation can be found with a
+# binary search and the text read with a single seek.
+#
+# header: magic, number of records
+# record: page, line_number, byte offset in the text output, byte length
+INDEX_MAGIC = b"TLX1"
+HEADER = struct.Struct("<4sI")
+RECORD = struct.Struct("<IIQI")
+
+# Capture a citation, ie., 45:12, 45:12-20, 45:12-46:3
+citation_regex = re.compile(
+    r"^\s*(\d+):(\d+)(?:\s*-\s*(?:(\d+):)?(\d+))?\s*$")
+
+
+def paragraph_offsets(par: Paragraph, rendered: str, offset: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Returns the (page, line_number, byte offset, byte length) of each line
+    of the paragraph, where rendered is the paragraph as written to the
+    text output and offset is the byte offset the rendered paragraph
+    starts at.
+    """
+
+    # The paragraph text is always at the end of the rendered string,
+    # after the line numbers and [Q] or [A].
+    text_start = len(rendered) - len(par.text)
+    ascii_only = rendered.isascii()
+
+    def _byte_position(i: int) -> int:
+        if ascii_only:
+            return i
+        return len(rendered[:i].encode("utf-8"))
+
+    records = list()
+    for page, line, start, end in par.line_spans:
+        byte_start = _byte_position(text_start + start)
+        byte_end = _byte_position(text_start + end)
+        records.append((page, line, offset + byte_start, byte_end - byte_start))
+
+    return records
+
+
+def write_offset_index(records: List[Tuple[int, int, int, int]], index_file: Path):
+    with open(index_file, "wb") as file:
+        file.write(build_offset_index(records))
+
+    logger.info(f"Wrote {len(records)} line offsets to {index_file.name}")
+
+
+def build_offset_index(records: List[Tuple[int, int, int, int]]) -> bytes:
+    records = sorted(records)
+    data = bytearray(HEADER.size + RECORD.size * len(records))
+    HEADER.pack_into(data, 0, INDEX_MAGIC, len(records))
+    for i, record in enumerate(records):
+        RECORD.pack_into(data, HEADER.size + i * RECORD.size, *record)
+
+    return bytes(data)
+
+
+def parse_citation(citation: str) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """
+    Returns the starting and ending (page, line) of a citation,
+    ie., 45:12-46:3 is ((45, 12), (46, 3)) and 45:12-20 is ((45, 12), (45, 20))
+    """
+    mo = citation_regex.search(citation)
+    if not mo:
+        raise ValueError(f"Invalid citation: {citation}")
+
+    start_page, start_line, end_page, end_line = mo.groups()
+    start = (int(start_page), int(start_line))
+
+    if end_line is None:
+        # Single line, ie., 45:12
+        return start, start
+
+    end = (int(end_page or start_page), int(end_line))
+    if end < start:
+        raise ValueError(f"Citation ends before it starts: {citation}")
+
+    return start, end
+
+
+class CitationIndex(object):
+    """
+    Resolves page:line citations against a text output using its
+    offset index.
+    """
+
+    def __init__(self, index_data: bytes, text: IO[bytes]):
+        magic, count = HEADER.unpack_from(index_data, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError("Not a transcript line offset index.")
+
+        self.index_data = index_data
+        self.count = count
+        self.text = text
+
+    @classmethod
+    def open(cls, txt_file: Path) -> "CitationIndex":
+        index_file = txt_file.with_suffix(".lines.idx")
+        with open(index_file, "rb") as file:
+            index_data = file.read()
+
+        return cls(index_data, open(txt_file, "rb"))
+
+    def close(self):
+        self.text.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _record(self, i: int) -> Tuple[int, int, int, int]:
+        return RECORD.unpack_from(self.index_data, HEADER.size + i * RECORD.size)
+
+    def _bisect_left(self, key: Tuple[int, int]) -> int:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid)[:2] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _bisect_right(self, key: Tuple[int, int]) -> int:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < self._record(mid)[:2]:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def lookup(self, citation: str) -> List[Tuple[int, int, str]]:
+        """
+        Returns the (page, line_number, text) of each line in the citation.
+        """
+        start, end = parse_citation(citation)
+
+        first = self._bisect_left(start)
+        last = self._bisect_right(end)
+        records = [self._record(i) for i in range(first, last)]
+
+        if not records:
+            return list()
+
+        # Read the whole span with a single seek
+        span_start = min(r[2] for r in records)
+        span_end = max(r[2] + r[3] for r in records)
+        self.text.seek(span_start)
+        data = self.text.read(span_end - span_start)
+
+        lines = list()
+        for page, line, offset, length in records:
+            chunk = data[offset - span_start:offset - span_start + length]
+            lines.append((page, line, chunk.decode("utf-8")))
+
+        return lines
+
+    def text_for(self, citation: str) -> str:
+        """
+        Returns the text of the citation as a single string.
+        """
+        return " ".join(text for _, _, text in self.lookup(citation) if text)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="Transcript Citations",
+        description="Look up the text of page:line citations in a converted transcript.",
+    )
+    parser.add_argument(
+        "path",
+        help="A path to a converted transcript txt file with a .lines.idx index.",
+    )
+    parser.add_argument(
+        "citations",
+        nargs="*",
+        help="Citations to look up, ie. 45:12-46:3. Reads one per line from stdin if none are given.",
+    )
+    args = parser.parse_args()
+
+    citations = args.citations or (l.strip() for l in sys.stdin if l.strip())
+
+    with CitationIndex.open(Path(args.path)) as index:
+        for citation in citations:
+            try:
+                print(f"{citation}\t{index.text_for(citation)}")
+            except ValueError as err:
+                print(f"{citation}\tERROR: {err}", file=sys.stderr)
@@ -0,0 +1,237 @@
+import json
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Set
+
+from exporter import read_outline_speakers
+from main import convert_file, output_path, transcript_files
+from miner import shared_resource_manager
+
+logger = logging.getLogger(__name__)
+
+
+# Capture the citation at the start of a paragraph, ie. [45:12-46:3  ]
+citation_prefix_regex = re.compile(r"^\[([^\]]*?)\s*\]\s*")
+digits_regex = re.compile(r"(\d+)")
+# Capture the volume number in a file name, ie. Vol 2, Volume_10, v3.
+# A lone "v" must be joined to its number, so the "v." of a case caption
+# (ie. Doe v 3M, US v. 2-21-cr-123) is not taken as a volume.
+volume_regex = re.compile(
+    r"(?:^|[^a-z])(?:vol(?:ume)?\.?[\s._-]*|v)(\d+)(?![a-z0-9])", re.IGNORECASE)
+
+
+def _natural_key(file_path: Path):
+    """
+    Sort key so Volume 2 comes before Volume 10.
+    """
+    return [int(part) if part.isdigit() else part.lower()
+            for part in digits_regex.split(file_path.name)]
+
+
+def volume_label(file_path: Path) -> str:
+    """
+    The volume of a transcript from its file name, ie. 2 for Vol 2.pdf.
+    The last volume number in the name is used, ie. 3 for Vol 1 v3.pdf.
+    Names without a volume number (ie. dates) are used as they are.
+    """
+    numbers = volume_regex.findall(file_path.stem)
+    if numbers:
+        return str(int(numbers[-1]))
+    return file_path.stem
+
+
+def _convert_volume(file_path: Path, options: dict) -> Path:
+    """
+    Convert a single volume in a worker process.
+    """
+    # Each worker shares fonts and CMaps across the volumes it converts
+    convert_file(file_path, lnNum=True, rsrcmgr=shared_resource_manager(),
+                 **options)
+
+    txt_file = output_path(file_path)
+    if not txt_file.is_file():
+        raise FileNotFoundError(f"{file_path.name} was not converted")
+    return txt_file
+
+
+def _volume_paragraphs(volume: str, txt_file: Path) -> Iterator[str]:
+    """
+    Stream the paragraphs of a converted volume, with the volume label
+    added to each citation, ie. [45:12-46:3] is [2:45:12-46:3] in volume 2.
+    """
+    with open(txt_file, "r", encoding="utf-8") as file:
+        for line in file:
+            mo = citation_prefix_regex.search(line)
+            if not mo:
+                yield line
+                continue
+
+            text = line[mo.end():]
+            if not text.strip():
+                # Skip empty paragraphs
+                continue
+
+            citation = "{:<14}".format(f"{volume}:{mo.group(1)}")
+            yield f"[{citation}]  {text}"
+
+
+def _duplicate_labels(volume_labels: List[str]) -> Set[str]:
+    return {label for label in volume_labels if volume_labels.count(label) > 1}
+
+
+def build_corpus(volumes: List[Path],
+                 output: Path,
+                 max_workers: int | None = None,
+                 sort_volumes: bool = True,
+                 labels: Dict[Path, str] | None = None,
+                 **options) -> Path:
+    """
+    Convert the volumes of a transcript in parallel, and merge them in
+    volume order into one consolidated transcript with volume:page:line
+    citations, and one speaker table across every volume.
+
+    The volume in each citation comes from labels, or else from the file
+    name (see volume_label), so Vol 10.pdf is cited as volume 10 even if
+    other volumes are missing. If file names give two volumes the same
+    label, the volumes without a label are cited by their position instead.
+
+    Each volume is appended to the output as soon as it and the volumes
+    before it are converted, reading its text output one line at a time.
+    A volume that fails to convert is logged and left out. The output is
+    written to a temporary file, and only replaces output once complete.
+    options are passed to convert_file, ie. qa or the margins.
+    """
+    if sort_volumes:
+        volumes = sorted(volumes, key=_natural_key)
+
+    labels = labels or dict()
+    volume_labels = [labels.get(v) or volume_label(v) for v in volumes]
+    duplicates = _duplicate_labels(volume_labels)
+    if duplicates:
+        logger.warning(
+            f"Volumes have the same label {sorted(duplicates)}, citing volumes by their position instead.")
+        volume_labels = [labels.get(v) or str(position)
+                         for position, v in enumerate(volumes, start=1)]
+        duplicates = _duplicate_labels(volume_labels)
+    if duplicates:
+        raise ValueError(
+            f"Volumes have the same label, citations would be ambiguous: {sorted(duplicates)}")
+
+    logger.info(f"Building corpus from {len(volumes)} volumes")
+
+    # speaker: ["volume:page", ...]
+    speakers: Dict[str, List[str]] = dict()
+    merged = list()
+    failed = list()
+
+    speakers_file = output.with_suffix(".speakers.json")
+    tmp_output = output.with_name(f"{output.name}.tmp")
+    tmp_speakers = speakers_file.with_name(f"{speakers_file.name}.tmp")
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_convert_volume, v, options)
+                   for v in volumes]
+
+        with open(tmp_output, "w", encoding="utf-8") as file:
+            # Merge in volume order, as each volume finishes
+            for volume, source, future in zip(volume_labels, volumes, futures):
+                try:
+                    txt_file = future.result()
+                except Exception as err:
+                    logger.error(
+                        f"Unable to convert volume {volume}: {source.name}. Leaving it out.")
+                    logger.error(err)
+                    failed.append({"volume": volume, "source": str(source), "error": str(err)})
+                    continue
+
+                logger.info(f"Merging volume {volume}: {source.name}")
+                file.writelines(_volume_paragraphs(volume, txt_file))
+                merged.append({"volume": volume, "source": str(source)})
+
+                outline_file = txt_file.with_suffix(".outline.json")
+                for name, pages in read_outline_speakers(outline_file).items():
+                    speakers.setdefault(name, list()).extend(
+                        f"{volume}:{page}" for page in pages)
+
+    with open(tmp_speakers, "w", encoding="utf-8") as file:
+        json.dump({
+            "volumes": merged,
+            "failed": failed,
+            "speakers": speakers,
+        }, file, indent=2)
+
+    os.replace(tmp_output, output)
+    os.replace(tmp_speakers, speakers_file)
+
+    logger.info(
+        f"Wrote corpus of {len(merged)} volumes to {output}, speakers to {speakers_file.name}")
+    if failed:
+        logger.warning(
+            f"{len(failed)} volumes failed: {', '.join(f['source'] for f in failed)}")
+
+    return output
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stdout,
+        format="%(levelname)s.%(name)s:%(lineno)d - %(message)s",
+        level=logging.INFO,
+    )
+    logging.getLogger("pdfminer").setLevel(logging.ERROR)
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="Transcript Corpus",
+        description="Convert the volumes of a transcript in parallel and merge them into one transcript.",
+    )
+    parser.add_argument("output", help="The consolidated transcript txt file.")
+    parser.add_argument(
+        "volumes",
+        nargs="+",
+        help="Volume transcripts, or a directory containing them. Volumes are ordered by name, ie. Vol 2 before Vol 10.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes. The default is the number of CPUs.",
+    )
+    parser.add_argument(
+        "--label",
+        action="append",
+        default=list(),
+        metavar="FILE=N",
+        help="Cite a volume as N, ie. --label \"Doe v 3M.pdf=1\". FILE is the file name or path. May be repeated.",
+    )
+    args = parser.parse_args()
+
+    volumes: List[Path] = list()
+    for v in args.volumes:
+        p = Path(v)
+        if p.is_dir():
+            volumes.extend(transcript_files(p, sorted(x.name for x in p.iterdir() if x.is_file())))
+        else:
+            volumes.append(p)
+
+    labels: Dict[Path, str] = dict()
+    for label in args.label:
+        file_name, sep, volume = label.rpartition("=")
+        if not sep or not file_name or not volume:
+            parser.error(f"--label must be FILE=N: {label}")
+        matches = [v for v in volumes if v.name == file_name or v == Path(file_name)]
+        if not matches:
+            parser.error(f"--label {label}: {file_name} is not one of the volumes")
+        for v in matches:
+            labels[v] = volume
+
+    try:
+        build_corpus(volumes, Path(args.output), max_workers=args.workers,
+                     labels=labels, bottom_margin=53)
+    except ValueError as err:
+        parser.error(str(err))
@@ -0,0 +1,377 @@
+import bisect
+import io
+import logging
+import re
+import sys
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from archive import MANIFEST, TranscriptArchive
+from exporter import Paragraph, Section, qa
+
+logger = logging.getLogger(__name__)
+
+
+# MinHash signatures with NUM_PERM hashes, split into BANDS bands for
+# locality sensitive hashing. Paragraphs sharing every row of at least one
+# band are candidates. With 16 bands of 8 rows, pairs with a Jaccard
+# similarity of about 0.7 and up are likely to share a band.
+NUM_PERM = 128
+BANDS = 16
+# Shingles are runs of SHINGLE_SIZE words. Paragraphs with fewer than
+# MIN_WORDS words (ie. "Yes, sir.") are too short to compare.
+SHINGLE_SIZE = 5
+MIN_WORDS = 8
+
+# Fixed seed, so signatures from different runs can be compared
+_rng = np.random.default_rng(1729)
+# a * x + b mod p, with a < 2**31 and x < 2**32 so it cannot overflow
+_PRIME = np.uint64(4294967311)
+_A = _rng.integers(1, 1 << 31, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 31, NUM_PERM, dtype=np.uint64)
+# Odd multipliers for hashing the rows of a band into one key
+_ROW_MULTIPLIERS = _rng.integers(
+    1, 1 << 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+
+word_regex = re.compile(r"[a-z0-9']+")
+
+# Text kept with each signature. Each is stored as one UTF-8 blob and the
+# offsets of its strings, instead of a fixed width unicode array padded
+# to the longest string (4 bytes a character).
+META_FIELDS = ("citations", "speakers", "texts", "answers")
+
+
+def _shingle_hashes(text: str) -> np.ndarray | None:
+    words = word_regex.findall(text.lower())
+    if len(words) < MIN_WORDS:
+        return None
+
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE])
+                for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles),
+                       dtype=np.uint64, count=len(shingles))
+
+
+def minhash(text: str) -> np.ndarray | None:
+    """
+    Returns the MinHash signature of the text, or None if it is too short.
+    """
+    hashes = _shingle_hashes(text)
+    if hashes is None:
+        return None
+
+    # (NUM_PERM, number of shingles)
+    permuted = (_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def _q_or_a(par: Paragraph) -> str:
+    if par.question:
+        return "Q"
+    if par.answer:
+        return "A"
+    # The Q. or A. may still be in the text, ie. "Q. Where were you?"
+    mo = qa.search(par.text)
+    return mo.group()[0] if mo else ""
+
+
+def _section_at(sections: List[Section], page: int, line: int) -> Section | None:
+    for section in sections:
+        if (section.page_start, section.line_start) <= (page, line) <= (section.page_end, section.line_end):
+            return section
+    return None
+
+
+def _speaker_label(par: Paragraph, sections: List[Section]) -> str:
+    """
+    The speaker of a paragraph, ie. MR. JONES, or for questions and answers
+    the questioner or witness of the examination they are part of.
+    """
+    if par.speaker:
+        return par.speaker.name.rstrip(":")
+
+    q_or_a = _q_or_a(par)
+    section = _section_at(sections, par.page_start, par.line_start)
+    if q_or_a == "Q" and section and section.questioner:
+        return f"Q ({section.questioner})"
+    if q_or_a == "A" and section and section.witness:
+        return f"A ({section.witness})"
+    return q_or_a
+
+
+def _citation(par: Paragraph) -> str:
+    if par.page_start != par.page_end:
+        return f"{par.page_start}:{par.line_start}-{par.page_end}:{par.line_end}"
+    return f"{par.page_start}:{par.line_start}-{par.line_end}"
+
+
+def _pack_strings(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the strings as one UTF-8 blob, and the n + 1 offsets of the
+    strings in it.
+    """
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def signatures_to_npz(paragraphs: List[Paragraph], sections: List[Section] | None = None) -> bytes:
+    """
+    Compute the MinHash signature of each paragraph, and return them with
+    the citation, speaker and text of each paragraph as an .npz file.
+    sections, from lines_to_paragraphs, name the questioner and witness.
+
+    For a question, the answer that follows it is kept as well, so
+    repeated questions with different answers stand out in the report.
+    """
+    sections = sections or list()
+    signatures = list()
+    citations = list()
+    speakers = list()
+    texts = list()
+    answers = list()
+
+    for i, par in enumerate(paragraphs):
+        signature = minhash(par.text)
+        if signature is None:
+            continue
+
+        answer = ""
+        if _q_or_a(par) == "Q" and i + 1 < len(paragraphs) and _q_or_a(paragraphs[i + 1]) == "A":
+            answer = paragraphs[i + 1].text
+
+        signatures.append(signature)
+        citations.append(_citation(par))
+        speakers.append(_speaker_label(par, sections))
+        texts.append(par.text)
+        answers.append(answer)
+
+    arrays = {"signatures": np.array(signatures, dtype=np.uint32).reshape(-1, NUM_PERM)}
+    for key, strings in zip(META_FIELDS, (citations, speakers, texts, answers)):
+        arrays[key], arrays[f"{key}_offsets"] = _pack_strings(strings)
+
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+
+    logger.info(f"Computed {len(signatures)} paragraph signatures")
+    return buffer.getvalue()
+
+
+class LSHIndex(object):
+    """
+    Locality sensitive hashing index over the paragraph signatures of
+    a corpus of transcripts.
+
+    Only the signatures are kept in memory. The citation and text of a
+    paragraph are read from its .npz file when it is described, keeping
+    the text of at most max_cached_sources transcripts.
+    """
+
+    def __init__(self, bands: int = BANDS, max_cached_sources: int = 16):
+        if NUM_PERM % bands:
+            raise ValueError(f"{NUM_PERM} hashes cannot be split into {bands} bands")
+
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self._multipliers = _ROW_MULTIPLIERS[:self.rows]
+        self._keys: List[np.ndarray] = list()
+        self._signatures: List[np.ndarray] = list()
+        self.sources: List[str] = list()
+        # The compressed .npz of each source, and the index of its first
+        # paragraph
+        self._npz_data: List[bytes] = list()
+        self._starts: List[int] = [0]
+        self.max_cached_sources = max_cached_sources
+        self._meta_cache: "OrderedDict[int, Dict[str, np.ndarray]]" = OrderedDict()
+
+    def add(self, source: str, npz_data: bytes):
+        """
+        Add the signatures of a transcript, from signatures_to_npz.
+        """
+        with np.load(io.BytesIO(npz_data)) as npz:
+            signatures = npz["signatures"]
+
+        # One key per band, hashing the rows of the band together
+        banded = signatures.reshape(-1, self.bands,
+                                    self.rows).astype(np.uint64)
+        keys = (banded * self._multipliers).sum(axis=2, dtype=np.uint64)
+
+        self._keys.append(keys)
+        self._signatures.append(signatures)
+        self._npz_data.append(npz_data)
+        self._starts.append(self._starts[-1] + len(signatures))
+        self.sources.append(source)
+
+        logger.info(f"Indexed {len(signatures)} paragraphs from {source}")
+
+    def near_duplicates(self, threshold: float = 0.7, max_bucket_size: int = 1000) -> List[Tuple[float, int, int]]:
+        """
+        Returns (similarity, paragraph, paragraph) of the paragraph pairs
+        with an estimated Jaccard similarity of at least threshold.
+
+        Buckets with more than max_bucket_size paragraphs (ie. boilerplate
+        repeated in every transcript) are skipped.
+        """
+        if not self._keys:
+            return list()
+
+        keys = np.concatenate(self._keys)
+        signatures = np.concatenate(self._signatures)
+
+        n = len(keys)
+        if n < 2:
+            return list()
+
+        candidates = list()
+        for band in range(self.bands):
+            order = np.argsort(keys[:, band], kind="stable")
+            sorted_keys = keys[order, band]
+
+            # Runs of equal keys are buckets
+            starts = np.flatnonzero(
+                np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+            sizes = np.diff(np.append(starts, n))
+
+            oversized = sizes > max_bucket_size
+            if oversized.any():
+                logger.warning(
+                    f"Skipping {int(oversized.sum())} buckets of more than {max_bucket_size} paragraphs in band {band}")
+
+            # Pair the members of every bucket of the same size at once,
+            # so the work is proportional to the number of pairs
+            usable = np.flatnonzero((sizes >= 2) & ~oversized)
+            usable = usable[np.argsort(sizes[usable], kind="stable")]
+            usable_sizes = sizes[usable]
+            groups = np.flatnonzero(np.diff(usable_sizes)) + 1
+            for group in np.split(usable, groups):
+                if not len(group):
+                    continue
+                size = int(sizes[group[0]])
+                bucket_starts = starts[group]
+                first, second = np.triu_indices(size, k=1)
+                a = order[bucket_starts[:, None] + first]
+                b = order[bucket_starts[:, None] + second]
+                candidates.append((np.minimum(a, b) * n + np.maximum(a, b)).ravel())
+
+        if not candidates:
+            return list()
+        # Pairs found in more than one band
+        candidates = np.sort(np.concatenate(candidates))
+        candidates = candidates[np.concatenate(
+            ([True], candidates[1:] != candidates[:-1]))]
+
+        pairs = np.stack((candidates // n, candidates % n), axis=1)
+        similarity = (signatures[pairs[:, 0]] ==
+                      signatures[pairs[:, 1]]).mean(axis=1)
+        keep = similarity >= threshold
+
+        logger.info(
+            f"{len(pairs)} candidate pairs, {int(keep.sum())} near duplicates")
+
+        similarity = similarity[keep]
+        pairs = pairs[keep]
+        # Most similar first
+        ranked = np.argsort(-similarity, kind="stable")
+        return list(zip(similarity[ranked].tolist(),
+                        pairs[ranked, 0].tolist(), pairs[ranked, 1].tolist()))
+
+    def _source_meta(self, source: int) -> Dict[str, np.ndarray]:
+        meta = self._meta_cache.get(source)
+        if meta is not None:
+            self._meta_cache.move_to_end(source)
+            return meta
+
+        with np.load(io.BytesIO(self._npz_data[source])) as npz:
+            meta = {key: npz[key] for key in npz.files if key != "signatures"}
+
+        self._meta_cache[source] = meta
+        if len(self._meta_cache) > self.max_cached_sources:
+            self._meta_cache.popitem(last=False)
+        return meta
+
+    def describe(self, i: int) -> Dict[str, str]:
+        """
+        Returns the source, citation, speaker, text and answer of a paragraph.
+        """
+        source = bisect.bisect_right(self._starts, i) - 1
+        j = i - self._starts[source]
+        meta = self._source_meta(source)
+
+        described = {"source": self.sources[source]}
+        for key in META_FIELDS:
+            offsets = meta.get(f"{key}_offsets")
+            if offsets is None:
+                # Written as a unicode array by an earlier version
+                described[key] = str(meta[key][j])
+            else:
+                described[key] = meta[key][offsets[j]:offsets[j + 1]].tobytes().decode("utf-8")
+        return described
+
+
+def _load_signature_files(index: LSHIndex, path: Path):
+    """
+    Add every .minhash.npz file under path, including those in
+    transcript archives, to the index.
+    """
+    if (path / MANIFEST).is_file():
+        with TranscriptArchive(path, read_only=True) as archive:
+            for name in archive.names():
+                if name.endswith(".minhash.npz"):
+                    index.add(f"{path.name}:{name}", archive.read(name))
+
+    elif path.is_dir():
+        for p in sorted(path.iterdir()):
+            if p.is_dir() or p.name.endswith(".minhash.npz"):
+                _load_signature_files(index, p)
+
+    elif path.name.endswith(".minhash.npz"):
+        index.add(str(path), path.read_bytes())
+
+
+def _preview(text: str, length: int = 100) -> str:
+    return text if len(text) <= length else f"{text[:length]}..."
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        stream=sys.stderr,
+        format="%(levelname)s.%(name)s:%(lineno)d - %(message)s",
+        level=logging.INFO,
+    )
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="Transcript Near Duplicates",
+        description="Report near duplicate paragraphs across converted transcripts (converted with --minhash).",
+    )
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help=".minhash.npz files, transcript archives, or directories containing them.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.7,
+        help="Minimum estimated Jaccard similarity of a pair. The default is 0.7.",
+    )
+    args = parser.parse_args()
+
+    index = LSHIndex()
+    for p in args.paths:
+        _load_signature_files(index, Path(p))
+
+    for similarity, a, b in index.near_duplicates(threshold=args.threshold):
+        first = index.describe(a)
+        second = index.describe(b)
+        print(f"{similarity:.2f}")
+        for par in (first, second):
+            print(f"  {par['source']} [{par['citations']}] {par['speakers']}: {_preview(par['texts'])}")
+            if par["answers"]:
+                print(f"      [A] {_preview(par['answers'])}")
@@ -1,6 +1,8 @@
+import json
 import logging
 import re
-from typing import List, Type, IO, Dict, Set
+from pathlib import Path
+from typing import List, Type, IO, Dict, Set, Tuple
 from miner import Line
 import pprint
 from datetime import datetime
@@ -49,6 +51,47 @@ class Speaker(object):
         return f"<SPEAKER: {self.name} Pages: {self.pages}>"
 
 
+class Section(object):
+    """
+    Represents one examination of a witness, ie., the cross-examination
+    of the third witness, and the page/line span it covers.
+    """
+
+    def __init__(self, witness: str | None, witness_number: int, examination: str, page: int, line: int):
+        self.witness = witness
+        self.witness_number = witness_number
+        self.examination = examination
+        self.questioner: str | None = None
+        self.page_start: int = page
+        self.line_start: int = line
+        self.page_end: int = page
+        self.line_end: int = line
+
+    def __repr__(self):
+        return f"<SECTION: {self.examination} of {self.witness} ({self.witness_number}) by {self.questioner} [{self.page_start}:{self.line_start}-{self.page_end}:{self.line_end}]>"
+
+    def to_dict(self) -> dict:
+        return {
+            "witness": self.witness,
+            "witness_number": self.witness_number,
+            "examination": self.examination,
+            "questioner": self.questioner,
+            "page_start": self.page_start,
+            "line_start": self.line_start,
+            "page_end": self.page_end,
+            "line_end": self.line_end,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Section":
+        section = cls(d["witness"], d["witness_number"],
+                      d["examination"], d["page_start"], d["line_start"])
+        section.questioner = d["questioner"]
+        section.page_end = d["page_end"]
+        section.line_end = d["line_end"]
+        return section
+
+
 class Paragraph(object):
     """
     Represents a paragraph of text with a primary speaker.
@@ -63,6 +106,8 @@ class Paragraph(object):
         self.line_end: int = 0
         self.question: bool = False
         self.answer: bool = False
+        # (page, line_number, start, end) of each line within self.text
+        self.line_spans: List[Tuple[int, int, int, int]] = list()
 
     def __repr__(self) -> str:
         return f"<PARAGRAPH: {self.name} Pages: {self.pages}>"
@@ -94,14 +139,30 @@ class Paragraph(object):
         else:
             self.text = f"{self.text} {text.strip()}"
 
+    def add_line(self, l: Line):
+        """
+        Add the text of a transcript line and remember where it landed
+        in the paragraph text, so a page:line citation can be resolved.
+        """
+        self.add_text(l.text)
+        stripped = l.text.strip()
+        end = len(self.text)
+        self.line_spans.append(
+            (l.page, l.line_number, end - len(stripped), end))
+
     def remove_q_a(self):
         # Remove Q. or A. from text
         # Just REMOVE Q. A.
         # Q. A. constantly being read aloud is distracting and interupts the flow
         # print(bytes(self.text, encoding="utf-8"))
         res = qa.sub("", self.text)
+        removed = len(self.text) - len(res)
         self.text = res
 
+        # Shift the line spans to account for the removed Q. or A.
+        self.line_spans = [(page, line, max(start - removed, 0), max(end - removed, 0))
+                           for page, line, start, end in self.line_spans]
+
 
 # qa = re.compile("^[AQ]\.\s+")  # Capture Q. or A.
 # qa = re.compile("^[AQ]")  # Capture Q. or A.
@@ -112,6 +173,21 @@ speaker_regex = re.compile(
 # Capture new speaker, ie., BY MR. SMITH:
 by_mr_smith_regex = re.compile("^BY [A-Z\.\s]+:$")
 empty_line_number = re.compile("^[0-9]{1,2}$")
+# Capture examination headings, ie., DIRECT EXAMINATION, CROSS-EXAMINATION,
+# REDIRECT-EXAMINATION, RECROSS EXAMINATION, or just EXAMINATION (Grand Jury)
+# With an optional note and questioner, ie., DIRECT EXAMINATION (Continued)
+# or EXAMINATION BY MR. SMITH:
+examination_regex = re.compile(
+    "^((?:RE-?)?(?:DIRECT|CROSS)[\s-]+)?EXAMINATION(\s*\([^)]*\))?(?:\s+BY\s+([A-Z][A-Z\.'\s-]*?):?)?$")
+# An examination heading that carries on an earlier one, ie. (Continued)
+continued_regex = re.compile("CONTINU|RESUM", re.IGNORECASE)
+# Capture the witness being called, ie., JOHN SMITH, having been first duly sworn
+witness_regex = re.compile(
+    "^([A-Z][A-Z\.'\s-]+?),\s+(?:a witness|called|having been)")
+# Or with the name on its own line, ie., JOHN SMITH,
+# followed by the sworn line, ie., having been first duly sworn
+witness_name_regex = re.compile("^([A-Z][A-Z\.'\s-]+?),?$")
+sworn_regex = re.compile("^(?:a witness|called|having been|being (?:first )?duly)")
 date_line_re = re.compile(
     "(Sunday|Monday|Tuesday|Wednesday|Thursday|Friday|Saturday), (January|February|March|April|May|June|July|August|September|October|November|December) ([\d]+), ([\d]{4})$"
 )
@@ -178,7 +254,7 @@ def _analyze_lines(lines: List[Line]):
             logger.debug("Q. A. Detected")
             _update_dict(q_a_dict, l, "New Questions Position")
 
-        elif speaker_regex.search(l.text):
+        elif speaker_regex.search(l.text) and not examination_regex.search(l.text):
             # New speaker detected
             # MR. SMITH:
             logger.debug("New speaker detected")
@@ -230,60 +306,158 @@ def _analyze_lines(lines: List[Line]):
     return (line_number_position, continuation_position, q_position, speaker_position)
 
 
-def lines_to_paragraphs(
-    lines: List[Line],
-):
+def _examination_name(mo_examination: re.Match) -> str:
+    """
+    Normalize an examination heading, ie., RE-DIRECT EXAMINATION and
+    REDIRECT-EXAMINATION are both REDIRECT EXAMINATION.
+    """
+    kind = mo_examination.group(1)
+    if not kind:
+        return "EXAMINATION"
+    kind = kind.replace("-", "").strip()
+    return f"{kind} EXAMINATION"
 
-    logger.info("Starting lines_to_paragraphs")
 
-    logger.debug(f"Lines:\n{pprint.pformat(lines)}")
+def outline_to_json(sections: List[Section], speakers: Dict[str, Speaker] | None = None) -> str:
+    outline = {
+        "sections": [s.to_dict() for s in sections],
+        "speakers": {name: sorted(speaker.pages) for name, speaker in (speakers or dict()).items()},
+    }
+    return json.dumps(outline, indent=2)
 
-    pos_line_number, pos_continue, pos_question, pos_speaker = _analyze_lines(
-        lines)
 
-    # So rather than compare two very specific floats,
-    # lets add 1.5 and cast to an integer
-    # anything less than this x value, will be a continuation line
-    continue_integer = int(pos_continue + 1.5)
-    logger.info(f"Continuation Position Detected at: {continue_integer}")
+def write_outline(sections: List[Section], outline_file: Path, speakers: Dict[str, Speaker] | None = None):
+    """
+    Write the section outline, and the pages of each speaker, to a small
+    json index file, so a review tool can open an examination by
+    page:line without the full text.
+    """
+    with open(outline_file, "w", encoding="utf-8") as file:
+        file.write(outline_to_json(sections, speakers))
 
-    paragraphs = list()
-    speakers: Dict[str, Speaker] = dict()
-    list_of_paragraph_objects: List[Paragraph] = list()
+    logger.info(f"Wrote {len(sections)} sections to {outline_file.name}")
+
+
+def read_outline(outline_file: Path) -> List[Section]:
+    with open(outline_file, "r", encoding="utf-8") as file:
+        outline = json.load(file)
+
+    return [Section.from_dict(d) for d in outline["sections"]]
+
+
+def read_outline_speakers(outline_file: Path) -> Dict[str, List[int]]:
+    """
+    Returns the pages of each speaker in the outline index file.
+    """
+    with open(outline_file, "r", encoding="utf-8") as file:
+        outline = json.load(file)
+
+    return outline.get("speakers", dict())
+
+
+class ParagraphAssembler(object):
+    """
+    Assembles transcript lines into paragraphs, one line at a time.
+
+    positions are the line number, continuation, question and speaker
+    start positions from _analyze_lines. Use from_lines to analyze them
+    from the lines of a transcript, or of its first pages.
+    """
+
+    def __init__(self, positions, sections: List[Section] | None = None, speakers: Dict[str, Speaker] | None = None):
+        pos_line_number, pos_continue, pos_question, pos_speaker = positions
+        self.pos_line_number = pos_line_number
+
+        # So rather than compare two very specific floats,
+        # lets add 1.5 and cast to an integer
+        # anything less than this x value, will be a continuation line
+        self.continue_integer = int(pos_continue + 1.5)
+        logger.info(
+            f"Continuation Position Detected at: {self.continue_integer}")
+
+        self.sections = sections if sections is not None else list()
+        self.speakers = speakers if speakers is not None else dict()
+
+        self.current_paragraph_object = Paragraph()
+        self.current_speaker = None
+        self.current_questioner = None
+        self.current_procedure: Section | None = None  # None, Direct, Cross
+        self.current_witness: str | None = None
+        self.witness_count = 0
+        # Whether the current witness has been examined yet
+        self._witness_examined = False
+        # A name on its own line, which is a witness if the next line
+        # is the sworn line
+        self._pending_witness: str | None = None
+        self.current_page_number = 0
+        self.date_of_transcript: datetime | None = None
+        self._last_line_started_paragraph = False
+
+    @classmethod
+    def from_lines(cls, lines: List[Line], sections: List[Section] | None = None, speakers: Dict[str, Speaker] | None = None) -> "ParagraphAssembler":
+        return cls(_analyze_lines(lines), sections=sections, speakers=speakers)
+
+    def _add_speaker(self, name: str, page: int) -> Speaker:
+        """
+        Returns the speaker with this name, ie. BY MR. SMITH:, adding it
+        or this page to the speakers.
+        """
+        if name in self.speakers:
+            speaker = self.speakers[name]
+            speaker.update_pages(page)
+        else:
+            speaker = Speaker(name, page=page)
+            self.speakers[name] = speaker
+        self.current_speaker = speaker
+        return speaker
+
+    def _new_witness(self, name: str):
+        """
+        A new witness is called. This ends the examination of the previous witness.
+        """
+        self.witness_count += 1
+        self.current_witness = name
+        self.current_procedure = None
+        self._witness_examined = False
+        logger.info(
+            f"New Witness Detected: {self.current_witness} ({self.witness_count})")
+
+    def add_line(self, l: Line) -> Paragraph | None:
+        """
+        Add the next transcript line. Returns the previous paragraph when
+        this line starts a new one.
+        """
+        finished = None
+        self._last_line_started_paragraph = False
 
-    new_paragraph = ""
-    current_paragraph_object = Paragraph()
-    current_speaker = None
-    current_questioner = None
-    current_procedure = None  # None, Direct, Cross
-    current_page_number = 0
-    starting_line = 0
-    starting_page = 0
-    ending_line = 0
-    date_of_transcript: datetime | None = None
-
-    for i, l in enumerate(lines):
         logger.debug(f"Current Line of Lines: {l}")
-        if current_page_number == 1:
+        if self.current_page_number == 1:
             # If this is the first page. Lets look for the
             # date of this transcript.
             # logger.info(l.text)
             date_match = date_line_re.search(l.text)
             if date_match:
                 # Transcript date found
-                date_of_transcript = datetime.strptime(
+                self.date_of_transcript = datetime.strptime(
                     date_match.group(0), "%A, %B %d, %Y")
                 logger.info(
-                    f"Transcript Date Found: {date_of_transcript.strftime('%A, %B %d, %Y')}")
+                    f"Transcript Date Found: {self.date_of_transcript.strftime('%A, %B %d, %Y')}")
+
+        # The name of a witness on the line before, ie. JOHN SMITH,
+        # followed by this sworn line, ie. having been first duly sworn
+        if self._pending_witness and not empty_line_number.search(l.text):
+            if sworn_regex.search(l.text):
+                self._new_witness(self._pending_witness)
+            self._pending_witness = None
 
         # Check if this line is a new line or a continuing line
         # Assumes all lines to the left of the continue_integer are
         # continuations of the same paragraph.
-        if l.start_position <= continue_integer:
+        if l.start_position <= self.continue_integer:
             logger.debug(
-                f"Continue {l.start_position} less than {continue_integer}")
+                f"Continue {l.start_position} less than {self.continue_integer}")
 
-            if l.start_position <= pos_line_number:
+            if l.start_position <= self.pos_line_number:
                 # This is an empty line number to the far left of the page
                 # print(
                 #     f"Skipping empty line. Page: {current_page_number}, Text: {l.text}"
@@ -294,9 +468,13 @@ def lines_to_paragraphs(
             else:
                 # Update the ending line number each time a continuation line
                 # is evaluated.
-                current_paragraph_object.add_text(l.text)
-                current_paragraph_object.line_end = l.line_number
-                current_paragraph_object.page_end = l.page
+                self.current_paragraph_object.add_line(l)
+                self.current_paragraph_object.line_end = l.line_number
+                self.current_paragraph_object.page_end = l.page
+
+                if self.current_procedure:
+                    self.current_procedure.page_end = l.page
+                    self.current_procedure.line_end = l.line_number
 
         else:
             # NEW PARAGRAPH
@@ -304,34 +482,71 @@ def lines_to_paragraphs(
             # This is to the right of the continuation integer.
             # This should be a new paragraph.
             logger.debug(
-                f"New Paragraph Detected: {l.start_position} greater than {continue_integer}")
+                f"New Paragraph Detected: {l.start_position} greater than {self.continue_integer}")
 
             # This is the start of a new paragraph, so deal with the
             # pre-existing paragraph before checking the new one
-            list_of_paragraph_objects.append(current_paragraph_object)
-            logger.debug(f"Appending Paragraph: {current_paragraph_object}")
+            finished = self.current_paragraph_object
+            logger.debug(f"Appending Paragraph: {finished}")
 
             # Reset Variables for New Paragraph
-            current_paragraph_object = Paragraph()  # New Paragraph
-            current_paragraph_object.add_text(l.text)
-            current_paragraph_object.page_start = l.page
-            current_paragraph_object.line_start = l.line_number
-            current_paragraph_object.page_end = l.page
-            current_paragraph_object.line_end = l.line_number
-
-            # Check if new speaker, ie. MR. NAME:
+            self.current_paragraph_object = Paragraph()  # New Paragraph
+            self.current_paragraph_object.add_line(l)
+            self.current_paragraph_object.page_start = l.page
+            self.current_paragraph_object.line_start = l.line_number
+            self.current_paragraph_object.page_end = l.page
+            self.current_paragraph_object.line_end = l.line_number
+
+            # Check for an examination heading first, as
+            # EXAMINATION BY MR. SMITH: is also a speaker.
+            # Then check if new speaker, ie. MR. NAME:
             mo_speaker_regex = speaker_regex.search(l.text)
-            if mo_speaker_regex:
+            mo_examination = examination_regex.search(l.text)
+            mo_witness = witness_regex.search(l.text)
+            if mo_examination:
+                # New examination, ie. DIRECT EXAMINATION, CROSS-EXAMINATION
+                # Grand Jury Transcripts just have EXAMINATION
+                kind = mo_examination.group(1)
+                continued = mo_examination.group(2) and continued_regex.search(
+                    mo_examination.group(2))
+                if self.current_witness is None:
+                    # Examination without a detected witness line.
+                    # Count it as a new, unnamed witness.
+                    self._new_witness("")
+                elif self._witness_examined and not continued and not mo_examination.group(3) and (
+                        not kind or kind.strip() == "DIRECT"):
+                    # A direct, or plain, examination after the current
+                    # witness was examined is a new, unnamed witness.
+                    # EXAMINATION BY MS. BROWN: is another attorney
+                    # examining the same witness.
+                    self._new_witness("")
+                self._witness_examined = True
+                self.current_procedure = Section(
+                    self.current_witness or None, self.witness_count, _examination_name(mo_examination), l.page, l.line_number)
+                self.sections.append(self.current_procedure)
+
+                if mo_examination.group(3):
+                    # The questioner is in the heading, ie.
+                    # EXAMINATION BY MR. SMITH:
+                    questioner = mo_examination.group(3).strip()
+                    self.current_procedure.questioner = questioner
+                    self.current_questioner = self._add_speaker(
+                        f"BY {questioner}:", l.page)
+                    self.current_paragraph_object.speaker = self.current_questioner
+
+                logger.info(f"New Section: {self.current_procedure}")
+
+            elif mo_speaker_regex:
                 # New Speaker
                 # logger.info("New speaker detected.")
                 # speakers.add(mo_speaker_regex.group(0))
                 this_speaker = mo_speaker_regex.group(0)
 
-                if speakers.__contains__(this_speaker):
+                if self.speakers.__contains__(this_speaker):
                     # update existing speaker
-                    existing_speaker = speakers[this_speaker]
+                    existing_speaker = self.speakers[this_speaker]
                     existing_speaker.update_pages(l.page)
-                    current_speaker = existing_speaker
+                    self.current_speaker = existing_speaker
                 else:
 
                     if this_speaker == "APPEARANCES:":
@@ -340,30 +555,27 @@ def lines_to_paragraphs(
                     else:
                         # create new speaker
                         new_speaker = Speaker(this_speaker, page=l.page)
-                        speakers[this_speaker] = new_speaker
-                        current_speaker = new_speaker
+                        self.speakers[this_speaker] = new_speaker
+                        self.current_speaker = new_speaker
 
-                current_paragraph_object.speaker = current_speaker
+                self.current_paragraph_object.speaker = self.current_speaker
 
                 if this_speaker.startswith("BY "):
-                    current_questioner = current_speaker
+                    self.current_questioner = self.current_speaker
 
-            # elif new_paragraph == "EXAMINATION":
-            #     # Grand Jury Transcripts just have EXAMINATION
-            #     current_procedure = "EXAMINATION"
-            #     new_paragraph = f"[***********] {new_paragraph}"
+                    if self.current_procedure and not self.current_procedure.questioner:
+                        # The first BY MR. SMITH: after the heading is
+                        # the attorney conducting this examination
+                        self.current_procedure.questioner = this_speaker[3:-1].strip()
 
-            # elif new_paragraph == "DIRECT EXAMINATION":
-            #     current_procedure = "DIRECT EXAMINATION"
-            #     new_paragraph = f"[***********] {new_paragraph}"
+            elif mo_witness:
+                # New witness, ie. JOHN SMITH, having been first duly sworn
+                self._new_witness(mo_witness.group(1).strip())
 
-            # elif new_paragraph == "CROSS-EXAMINATION":
-            #     current_procedure = "CROSS-EXAMINATION"
-            #     new_paragraph = f"[***********] {new_paragraph}"
-
-            # elif new_paragraph == "REDIRECT-EXAMINATION":
-            #     current_procedure = "REDIRECT-EXAMINATION"
-            #     new_paragraph = f"[***********] {new_paragraph}"
+            elif witness_name_regex.search(l.text):
+                # Maybe a witness, if the next line is the sworn line
+                self._pending_witness = witness_name_regex.search(
+                    l.text).group(1).strip()
 
             else:
                 # Check if starts with  Q. or A.
@@ -374,23 +586,69 @@ def lines_to_paragraphs(
 
                     if q_or_a == "Q":
                         # Add Question or Answer back in but with brackets
-                        current_paragraph_object.question = True
-                        current_paragraph_object.remove_q_a()
+                        self.current_paragraph_object.question = True
+                        self.current_paragraph_object.remove_q_a()
 
                     if q_or_a == "A":
-                        current_paragraph_object.answer = True
-                        current_paragraph_object.remove_q_a()
+                        self.current_paragraph_object.answer = True
+                        self.current_paragraph_object.remove_q_a()
+
+            if self.current_procedure:
+                self.current_procedure.page_end = l.page
+                self.current_procedure.line_end = l.line_number
 
-            # LAST LINE
-            # If Last Line Then Add IT AS PARAGRAPH
-            if len(lines) == i + 1:
-                logger.debug(f"Appending Last Paragraph: {new_paragraph}")
-                list_of_paragraph_objects.append(current_paragraph_object)
+            # The paragraph is only added by finish() if this is the last line
+            self._last_line_started_paragraph = True
 
         # Update Current Page Number
-        current_page_number = l.page
+        self.current_page_number = l.page
+
+        return finished
+
+    def finish(self) -> Paragraph | None:
+        """
+        Returns the last paragraph, once every line has been added.
+        """
+        # If Last Line Then Add IT AS PARAGRAPH
+        if self._last_line_started_paragraph:
+            logger.debug(
+                f"Appending Last Paragraph: {self.current_paragraph_object}")
+            return self.current_paragraph_object
+        return None
+
+
+def lines_to_paragraphs(
+    lines: List[Line],
+    sections: List[Section] | None = None,
+    speakers: Dict[str, Speaker] | None = None,
+):
+    """
+    Assemble transcript lines into paragraphs.
+
+    If a sections list is provided, it is filled with the examination
+    outline (witness, examination, questioner, page/line span) detected
+    while the paragraphs are assembled. If a speakers dict is provided,
+    it is filled with the detected speakers.
+    """
+
+    logger.info("Starting lines_to_paragraphs")
+
+    logger.debug(f"Lines:\n{pprint.pformat(lines)}")
+
+    assembler = ParagraphAssembler.from_lines(
+        lines, sections=sections, speakers=speakers)
+
+    list_of_paragraph_objects: List[Paragraph] = list()
+
+    for l in lines:
+        finished = assembler.add_line(l)
+        if finished:
+            list_of_paragraph_objects.append(finished)
+
+    last = assembler.finish()
+    if last:
+        list_of_paragraph_objects.append(last)
 
-    logger.debug(f"Paragraphs:\n{pprint.pformat(paragraphs)}")
-    logger.info(f"Detected Speakers:\n{pprint.pformat(speakers)}")
+    logger.info(f"Detected Speakers:\n{pprint.pformat(assembler.speakers)}")
 
     return list_of_paragraph_objects
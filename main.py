@@ -1,21 +1,76 @@
 import logging
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 import os
 import sys
+from typing import Dict, List
 
-from miner import MinePDFTranscript
-from exporter import lines_to_paragraphs
+from miner import MinePDFTranscript, PageRecord, PDFResourceManager, shared_resource_manager
+from exporter import Section, Speaker, lines_to_paragraphs, outline_to_json, write_outline
+from citations import build_offset_index, paragraph_offsets, write_offset_index
+from archive import TranscriptArchive
+from textreader import ReadTextTranscript, is_text_transcript
+from pagecache import change_report_to_json, compare_pages, page_cache_from_json, page_cache_to_json, summarize_changes
+from dedupe import signatures_to_npz
 
 logger = logging.getLogger(__name__)
 
 
+def output_path(file_path: Path) -> Path:
+    """
+    Returns the path of the text output for a transcript.
+
+    A transcript that comes as both depo.pdf and depo.txt is written to
+    depo.pdf.txt, so the reporter's text transcript is not overwritten.
+    """
+    if file_path.suffix.lower() == ".txt":
+        # Do not overwrite a plain text transcript
+        return file_path.with_name(f"{file_path.stem}.paragraphs.txt")
+
+    txt_file = file_path.with_suffix(".txt")
+    if txt_file.is_file() and is_text_transcript(txt_file):
+        return file_path.with_name(f"{file_path.name}.txt")
+    return txt_file
+
+
+def transcript_files(directory: Path, names: List[str]) -> List[Path]:
+    """
+    Returns the transcripts among the file names in a directory.
+    """
+
+    # Plain text transcripts convert much faster than PDFs, so
+    # prefer them when a transcript comes in both formats.
+    text_sources = {name for name in names
+                    if is_text_transcript(Path(directory, name))}
+    text_stems = {Path(name).stem for name in text_sources}
+
+    transcripts = list()
+    for name in names:
+        p = Path(directory, name)
+        # only look at PDF documents and text transcripts
+        if (p.suffix == ".pdf" or p.suffix == ".PDF") and p.stem in text_stems:
+            logger.info(f"Skipping PDF with a text transcript: {p.name}")
+
+        elif p.suffix == ".pdf" or p.suffix == ".PDF" or name in text_sources:
+            transcripts.append(p)
+
+        else:
+            logger.info(f"Skipping file with invalid suffix: {p.suffix}")
+
+    return transcripts
+
+
 def convert_file(file_path: Path,
                  lnNum: bool = True,
                  qa: bool = True,
                  left_margin: float = 0,
                  right_margin: float = 0,
                  bottom_margin: float = 0,
-                 top_margin: float = 0):
+                 top_margin: float = 0,
+                 archive: TranscriptArchive | None = None,
+                 archive_name: str | None = None,
+                 rsrcmgr: PDFResourceManager | None = None,
+                 previous: Path | None = None,
+                 minhash: bool = False):
 
     logger.info(f"Processing {file_path.name}")
 
@@ -26,27 +81,130 @@ def convert_file(file_path: Path,
         logger.warning(f"Path is not a file: {file_path}")
         return
 
-    if file_path.suffix != ".pdf":
+    text_source = is_text_transcript(file_path)
+    if not text_source and file_path.suffix != ".pdf":
         logger.warning(f"This file is not a PDF: {file_path}")
 
-    # Open the document stream
-    document = open(file_path, "rb")
-
-    # Extract the lines
-    lines = MinePDFTranscript(document, left_margin=left_margin,
-                              right_margin=right_margin, bottom_margin=bottom_margin, top_margin=top_margin)
+    if archive:
+        member = PurePosixPath(archive_name or file_path.name)
+
+    # Every file written next to the transcript is named after its text
+    # output, so the outputs of depo.pdf and depo.txt never collide.
+    txt_file = output_path(file_path)
+    page_cache_file = txt_file.with_suffix(".pages.json")
+    page_cache = None
+    change_report = None
+
+    if text_source:
+        # Plain text transcripts already have their lines, so skip
+        # PDF parsing entirely.
+        logger.info(f"Reading text transcript: {file_path.name}")
+        with open(file_path, "r", encoding="utf-8", errors="replace") as text_document:
+            lines = ReadTextTranscript(text_document)
+    else:
+        # Pages of the previous conversion of this transcript, or of the
+        # previous version given, so unchanged pages are not mined again.
+        params = {"left_margin": left_margin, "right_margin": right_margin,
+                  "bottom_margin": bottom_margin, "top_margin": top_margin}
+        previous_cache = None
+        if previous:
+            previous_cache = previous.read_text(encoding="utf-8")
+        elif archive and str(member.with_suffix(".pages.json")) in archive:
+            previous_cache = archive.read(
+                str(member.with_suffix(".pages.json"))).decode("utf-8")
+        elif not archive and page_cache_file.is_file():
+            previous_cache = page_cache_file.read_text(encoding="utf-8")
+
+        previous_pages = None
+        if previous_cache:
+            previous_pages = page_cache_from_json(previous_cache, params)
+
+        # Open the document stream
+        document = open(file_path, "rb")
+
+        # Extract the lines
+        pages: List[PageRecord] = list()
+        lines = MinePDFTranscript(document, left_margin=left_margin,
+                                  right_margin=right_margin, bottom_margin=bottom_margin, top_margin=top_margin,
+                                  rsrcmgr=rsrcmgr, previous_pages=previous_pages, pages=pages)
+
+        page_cache = page_cache_to_json(pages, params)
+        if previous_pages is not None:
+            changes = compare_pages(previous_pages, pages)
+            logger.info(f"Page changes: {summarize_changes(changes)}")
+            change_report = change_report_to_json(changes)
 
     logger.info(f"Lines: {lines[:5]}")
 
-    paragraphs = lines_to_paragraphs(lines)
-
-    txt_file = file_path.with_suffix(".txt")
-    with open(txt_file, "w", encoding="utf-8") as file:
-        for par in paragraphs:
-            logger.info(
-                f"Paragraph: {par.__str__(include_line_numbers=True, include_q_a_next_to_line_number=True)}")
-            file.write(
-                f"{par.__str__(include_line_numbers=lnNum, include_q_a_next_to_line_number=qa)}\n")
+    sections: List[Section] = list()
+    speakers: Dict[str, Speaker] = dict()
+    paragraphs = lines_to_paragraphs(
+        lines, sections=sections, speakers=speakers)
+
+    # Render the whole text output in memory, so it can be written
+    # with a single bulk write to a file or an archive member.
+    # (page, line_number, byte offset, byte length) of each line in the output
+    newline = "\n" if archive else os.linesep
+    rendered_paragraphs = list()
+    offsets = list()
+    offset = 0
+    for par in paragraphs:
+        logger.info(
+            f"Paragraph: {par.__str__(include_line_numbers=True, include_q_a_next_to_line_number=True)}")
+        rendered = par.__str__(
+            include_line_numbers=lnNum, include_q_a_next_to_line_number=qa)
+        rendered_paragraphs.append(f"{rendered}\n")
+
+        offsets.extend(paragraph_offsets(par, rendered, offset))
+        offset += len(f"{rendered}{newline}".encode("utf-8"))
+    text = "".join(rendered_paragraphs)
+
+    # Paragraph signatures for finding near duplicate testimony
+    # across a corpus, see dedupe.py
+    signatures = signatures_to_npz(
+        paragraphs, sections) if minhash else None
+
+    if archive:
+        archive.add(str(member.with_suffix(".txt")), text.encode("utf-8"))
+        # Sorted page:line offset index for citation lookups
+        archive.add(str(member.with_suffix(".lines.idx")),
+                    build_offset_index(offsets))
+        # Small index of the examinations, ie. cross of witness 3
+        archive.add(str(member.with_suffix(".outline.json")),
+                    outline_to_json(sections, speakers).encode("utf-8"))
+        if page_cache:
+            archive.add(str(member.with_suffix(".pages.json")),
+                        page_cache.encode("utf-8"))
+        if change_report:
+            archive.add(str(member.with_suffix(".changes.json")),
+                        change_report.encode("utf-8"))
+        if signatures:
+            archive.add(str(member.with_suffix(".minhash.npz")), signatures)
+    else:
+        if txt_file.is_file() and is_text_transcript(txt_file):
+            # Never write over a transcript
+            logger.warning(
+                f"Not writing {file_path.name}: its output {txt_file.name} is a text transcript.")
+            return
+
+        # The text file is written with the platform line separator
+        with open(txt_file, "w", encoding="utf-8") as file:
+            file.write(text)
+
+        # Sorted page:line offset index for citation lookups
+        write_offset_index(offsets, txt_file.with_suffix(".lines.idx"))
+
+        # Small index of the examinations, ie. cross of witness 3
+        write_outline(sections, txt_file.with_suffix(".outline.json"), speakers)
+
+        # Per page hashes and lines, for the next re-conversion
+        if page_cache:
+            page_cache_file.write_text(page_cache, encoding="utf-8")
+        if change_report:
+            txt_file.with_suffix(".changes.json").write_text(
+                change_report, encoding="utf-8")
+        if signatures:
+            txt_file.with_suffix(".minhash.npz").write_bytes(signatures)
 
     logger.info(f"Processed {len(lines)} transcript lines.")
 
@@ -58,7 +216,10 @@ def main(path_str: str,
          left_margin: float = 0,
          right_margin: float = 0,
          bottom_margin: float = 53,
-         top_margin: float = 0):
+         top_margin: float = 0,
+         archive_path: str | None = None,
+         previous: str | None = None,
+         minhash: bool = False):
 
     logger.info(f"Processing Path: {path_str}")
     logger.info(
@@ -68,32 +229,48 @@ def main(path_str: str,
             \n\t\t\tdate: {date} (include dates (only works with include page numbers True))")
     path = Path(path_str)
 
-    if path.is_dir():
-        for root, dirs, files in os.walk(path, topdown=False):
-            for name in files:
-                p = Path(root, name)
-                # only look at PDF documents
-                if p.suffix == ".pdf" or p.suffix == ".PDF":
+    if previous and path.is_dir():
+        # The pages of a previous version are for a single transcript.
+        # In a directory, each transcript uses its own .pages.json.
+        raise ValueError(
+            "previous can only be used with a single transcript, not a directory.")
+
+    # Write every result of the batch into one archive, instead of
+    # a txt file next to each PDF.
+    archive = TranscriptArchive(Path(archive_path)) if archive_path else None
+
+    try:
+        if path.is_dir():
+            # Share fonts and CMaps across every file in the batch
+            rsrcmgr = shared_resource_manager()
+
+            for root, dirs, files in os.walk(path, topdown=False):
+                for p in transcript_files(Path(root), files):
                     try:
                         convert_file(file_path=p, lnNum=lnNum,
-                                     qa=qa, left_margin=left_margin, right_margin=right_margin, bottom_margin=bottom_margin, top_margin=top_margin)
+                                     qa=qa, left_margin=left_margin, right_margin=right_margin, bottom_margin=bottom_margin, top_margin=top_margin,
+                                     archive=archive, archive_name=p.relative_to(path).as_posix(),
+                                     rsrcmgr=rsrcmgr, minhash=minhash)
 
                     except Exception as err:
                         logger.error(
                             f"ERROR: Unable to Process File: {p.__str__()}")
                         logger.error(err)
 
-                else:
-                    logger.info(
-                        f"Skipping file with invalid suffix: {p.suffix}")
-    else:
-        # Single File
-        if path.is_file():
-            convert_file(file_path=path, lnNum=lnNum,
-                         qa=qa, left_margin=left_margin, right_margin=right_margin, bottom_margin=bottom_margin, top_margin=top_margin)
+            logger.info(rsrcmgr.stats())
         else:
-            logger.warn("The provided path is not a file or directory.")
-
+            # Single File
+            if path.is_file():
+                convert_file(file_path=path, lnNum=lnNum,
+                             qa=qa, left_margin=left_margin, right_margin=right_margin, bottom_margin=bottom_margin, top_margin=top_margin,
+                             archive=archive, previous=Path(previous) if previous else None,
+                             minhash=minhash)
+            else:
+                logger.warn("The provided path is not a file or directory.")
+    finally:
+        if archive:
+            archive.close()
+            logger.info(f"Wrote archive: {archive.path}")
 
 if __name__ == "__main__":
     root = logging.getLogger()
@@ -135,7 +312,23 @@ if __name__ == "__main__":
     # positional required argument
     parser.add_argument(
         "path",
-        help="A path to a PDF transcript or directory contiaining PDF transcripts.",
+        help="A path to a PDF or plain text transcript, or a directory contiaining transcripts.",
+    )
+
+    parser.add_argument(
+        "--archive",
+        help="Write all of the converted transcripts into this archive directory instead of a txt file next to each PDF. Each run adds a segment to the archive; compact it with archive.py --compact.",
+    )
+
+    parser.add_argument(
+        "--previous",
+        help="The .pages.json of a previous version of this transcript. Only pages that changed are converted again.",
+    )
+
+    parser.add_argument(
+        "--minhash",
+        action="store_true",
+        help="Also write the MinHash signature of each paragraph, for finding near duplicate testimony with dedupe.py.",
     )
 
     # parser.add_argument(
@@ -153,13 +346,18 @@ if __name__ == "__main__":
     # parser.add_argument('--include_date_with_page_numbers')
     args = parser.parse_args()
 
+    if args.previous and Path(args.path).is_dir():
+        parser.error(
+            "--previous can only be used with a single transcript. In a directory, each transcript uses its own .pages.json.")
+
     print(f"Arguments: {args}")
     print(f"Working on Path: {args.path}")
 
     # if args.exlinenumbers:
     #     print("Exclude Line Numbers ON")
 
-    main(args.path, lnNum=True)
+    main(args.path, lnNum=True, archive_path=args.archive,
+         previous=args.previous, minhash=args.minhash)
     # main("./omar")
 
     print(f"COMPLETE")
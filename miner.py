@@ -1,13 +1,18 @@
+from collections import OrderedDict
 from enum import Enum
-from typing import List, Type, IO
+from typing import Dict, Iterator, List, Type, IO
 from datetime import datetime
+import hashlib
 import logging
 import re
+import time
 
 from pdfminer.converter import PDFPageAggregator
 from pdfminer.layout import LAParams, LTTextBoxHorizontal
+from pdfminer.pdffont import PDFFont
 from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
 from pdfminer.pdfpage import PDFPage
+from pdfminer.pdftypes import PDFStream, resolve1
 
 
 logger = logging.getLogger(__name__)
@@ -67,18 +72,267 @@ class Line(object):
             return f"Pg.{self.page:02} Ln: {self.line_number:02}, Start: {self.start_position}, Txt: {self.text}"
 
 
+class PageRecord(object):
+    """
+    Represents the extracted lines of a single page, and a hash of the
+    page content they were extracted from.
+    """
+
+    def __init__(self, page: int, hash: str, lines: List[Line]):
+        self.page = page
+        self.hash = hash
+        self.lines = lines
+
+    def __repr__(self):
+        return f"<PAGE: {self.page} {self.hash[:8]} Lines: {len(self.lines)}>"
+
+
+# Objects nested deeper than this (or with reference cycles) are not
+# fingerprinted, so they are never shared or reused.
+MAX_FINGERPRINT_DEPTH = 32
+
+
+class _FingerprintTooDeep(Exception):
+    pass
+
+
+def _update_fingerprint(h, obj, depth: int = 0, visited: Dict[int, int] | None = None):
+    """
+    Hash a font spec by content, resolving references, so the same font
+    embedded in two documents gets the same fingerprint.
+
+    An object reached again (ie. resources shared by a page and its Form
+    XObjects) is hashed as a back reference to its first visit, so it is
+    only hashed once and reference cycles end.
+    """
+    if depth > MAX_FINGERPRINT_DEPTH:
+        # Hashing a placeholder would give objects that only differ below
+        # this depth the same fingerprint
+        raise _FingerprintTooDeep()
+
+    if visited is None:
+        visited = dict()
+    obj = resolve1(obj)
+
+    if isinstance(obj, (dict, list, PDFStream)):
+        # Resolved objects are cached by the document, so a shared object
+        # is the same Python object. Numbered by first visit, not by id, so
+        # the hash does not depend on memory addresses or object numbers.
+        if id(obj) in visited:
+            h.update(f"@{visited[id(obj)]}".encode("utf-8"))
+            return
+        visited[id(obj)] = len(visited)
+
+    if isinstance(obj, dict):
+        h.update(b"<<")
+        for key in sorted(obj, key=str):
+            h.update(str(key).encode("utf-8"))
+            _update_fingerprint(h, obj[key], depth + 1, visited)
+        h.update(b">>")
+    elif isinstance(obj, list):
+        h.update(b"[")
+        for value in obj:
+            _update_fingerprint(h, value, depth + 1, visited)
+        h.update(b"]")
+    elif isinstance(obj, PDFStream):
+        # Hash the raw (undecoded) stream data, which is much cheaper
+        # than parsing the embedded font or CMap. pdfminer drops the raw
+        # data once a stream is decoded, so streams shared by pages must
+        # be hashed before any page is interpreted (see iter_transcript_pages).
+        h.update(b"stream")
+        _update_fingerprint(h, obj.attrs, depth + 1, visited)
+        data = obj.rawdata if obj.rawdata is not None else obj.data
+        h.update(data or b"")
+    else:
+        h.update(repr(obj).encode("utf-8"))
+
+
+def font_fingerprint(spec) -> str | None:
+    """
+    Returns the fingerprint of a font spec, or None if it is too deep.
+    """
+    h = hashlib.sha1()
+    try:
+        _update_fingerprint(h, spec)
+    except _FingerprintTooDeep:
+        return None
+    return h.hexdigest()
+
+
+def page_fingerprint(page: PDFPage) -> str | None:
+    """
+    Hash the content streams, resources and size of a page.
+    Returns None if the page is too deep to hash (ie. nested Form XObjects).
+    """
+    h = hashlib.sha1()
+    h.update(repr(page.mediabox).encode("utf-8"))
+    # One visited set, so resources used by the content streams are
+    # back references rather than hashed again
+    visited: Dict[int, int] = dict()
+    try:
+        _update_fingerprint(h, page.contents, visited=visited)
+        _update_fingerprint(h, page.resources, visited=visited)
+    except _FingerprintTooDeep:
+        logger.info("Page too deep to fingerprint, it is always mined again.")
+        return None
+    return h.hexdigest()
+
+
+def _embedded_cmaps(spec) -> int:
+    """
+    Count the CMaps embedded in a font spec, which are decoded when the
+    font is built: its ToUnicode CMap, and the Encoding CMap of a Type0 font.
+    """
+    if not isinstance(spec, dict):
+        return 0
+    count = 0
+    if isinstance(resolve1(spec.get("ToUnicode")), PDFStream):
+        count += 1
+    if isinstance(resolve1(spec.get("Encoding")), PDFStream):
+        count += 1
+    return count
+
+
+class SharedResourceManager(PDFResourceManager):
+    """
+    A resource manager that is shared by every document in a batch.
+
+    pdfminer caches fonts by object id, which is only unique within one
+    document. This manager also caches fonts by a fingerprint of their
+    content, so transcripts from the same reporter, which embed the same
+    fonts and CMaps, only parse them once. A different font always has a
+    different fingerprint. Fonts too deep to fingerprint are not shared.
+    The least recently used fonts are evicted once max_fonts are cached.
+
+    Embedded CMaps (ToUnicode and Type0 Encoding streams) are decoded as
+    part of building a font, so they are cached with it. They are counted
+    separately, as cmap_hits and cmap_misses.
+    """
+
+    def __init__(self, max_fonts: int = 256):
+        super().__init__(caching=True)
+        self.max_fonts = max_fonts
+        self._shared_fonts: OrderedDict[str, PDFFont] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.cmap_hits = 0
+        self.cmap_misses = 0
+        # Time spent building fonts on a miss
+        self.miss_seconds = 0.0
+
+    def begin_document(self):
+        # Object ids are only unique within a document
+        self._cached_fonts.clear()
+
+    def get_font(self, objid: object, spec) -> PDFFont:
+        if objid and objid in self._cached_fonts:
+            # Already seen in this document
+            return self._cached_fonts[objid]
+
+        key = font_fingerprint(spec)
+        font = self._shared_fonts.get(key) if key else None
+        cmaps = _embedded_cmaps(spec)
+
+        if font is not None:
+            self.hits += 1
+            self.cmap_hits += cmaps
+            self._shared_fonts.move_to_end(key)
+        else:
+            self.misses += 1
+            self.cmap_misses += cmaps
+            start = time.perf_counter()
+            # No object id, so the base class does not cache it
+            font = super().get_font(None, spec)
+            self.miss_seconds += time.perf_counter() - start
+
+            if key is None:
+                # Only cached by object id, for this document
+                logger.debug(f"Font too deep to fingerprint, not shared: {objid}")
+            else:
+                self._shared_fonts[key] = font
+            if len(self._shared_fonts) > self.max_fonts:
+                self._shared_fonts.popitem(last=False)
+                self.evictions += 1
+
+        if objid:
+            self._cached_fonts[objid] = font
+
+        return font
+
+    def stats(self) -> str:
+        average = self.miss_seconds / self.misses if self.misses else 0
+        return (f"Font cache hits: {self.hits}, misses: {self.misses}, evictions: {self.evictions}, "
+                f"CMap hits: {self.cmap_hits}, misses: {self.cmap_misses}, "
+                f"decoding time: {self.miss_seconds:.2f}s, estimated saved: {self.hits * average:.2f}s")
+
+
+_shared_resource_manager: SharedResourceManager | None = None
+
+
+def shared_resource_manager() -> SharedResourceManager:
+    """
+    Returns the process wide resource manager used in batch mode.
+    """
+    global _shared_resource_manager
+    if _shared_resource_manager is None:
+        _shared_resource_manager = SharedResourceManager()
+    return _shared_resource_manager
+
+
 def MinePDFTranscript(
     pdfData: IO,
     left_margin: float = 0,
     right_margin: float = 0,
     bottom_margin: float = 0,
     top_margin: float = 0,
+    rsrcmgr: PDFResourceManager | None = None,
+    previous_pages: List[PageRecord] | None = None,
+    pages: List[PageRecord] | None = None,
 ) -> List[Line]:
+    """
+    Extract the transcript lines from a PDF.
+
+    previous_pages are the page records of a previous version of this
+    transcript. Pages whose hash did not change are spliced from it,
+    instead of being interpreted again. If a pages list is provided, it is
+    filled with the page records of this conversion.
+    """
 
-    document = pdfData
     transcript_lines: List[Line] = list()
-    # Create resource manager
-    rsrcmgr = PDFResourceManager()
+
+    for page_lines in iter_transcript_pages(pdfData, left_margin=left_margin, right_margin=right_margin,
+                                            bottom_margin=bottom_margin, top_margin=top_margin, rsrcmgr=rsrcmgr,
+                                            previous_pages=previous_pages, pages=pages):
+        transcript_lines.extend(page_lines)
+
+    # for l in transcript_lines:
+    #     print(l)
+
+    return transcript_lines
+
+
+def iter_transcript_pages(
+    pdfData: IO,
+    left_margin: float = 0,
+    right_margin: float = 0,
+    bottom_margin: float = 0,
+    top_margin: float = 0,
+    rsrcmgr: PDFResourceManager | None = None,
+    previous_pages: List[PageRecord] | None = None,
+    pages: List[PageRecord] | None = None,
+) -> Iterator[List[Line]]:
+    """
+    Extract the transcript lines from a PDF, one page at a time.
+    See MinePDFTranscript.
+    """
+
+    document = pdfData
+    if rsrcmgr is None:
+        # Create resource manager
+        rsrcmgr = PDFResourceManager()
+    elif isinstance(rsrcmgr, SharedResourceManager):
+        rsrcmgr.begin_document()
     # Set parameters for analysis.
 
     # Parameters for layout analysis
@@ -102,64 +356,105 @@ def MinePDFTranscript(
     # [6:10-12   ]  [Q.] And so, that time s t amp up in the top right corner, the body-worn camer a , wher e it says 2021/08/07, that's the date of August 7th, right?
 
     # Create a PDF page aggregator object.
+    # The aggregator and interpreter hold per document state (ie. the page
+    # number), and are cheap to create, so only the resource manager is shared.
     device = PDFPageAggregator(rsrcmgr, laparams=laparams)
     interpreter = PDFPageInterpreter(rsrcmgr, device)
 
-    for page in PDFPage.get_pages(document):
-        interpreter.process_page(page)
-        # receive the LTPage object for the page.
-        layout = device.get_result()
-        # print("Layout: " + str(layout.pageid))  # Actual Page ID, 1 based
-        # print("Page: " + str(page.pageid))
+    # Reuse the lines of pages whose content did not change since the
+    # previous conversion, looked up by page hash.
+    previous_by_hash: Dict[str, PageRecord] = dict()
+    for record in previous_pages or list():
+        if record.hash:
+            previous_by_hash[record.hash] = record
+
+    document_pages = PDFPage.get_pages(document)
+    page_hashes: List[str] | None = None
+    if pages is not None or previous_by_hash:
+        # Fingerprint every page before interpreting any of them. Fonts and
+        # other resources are shared by pages, and interpreting a page
+        # decodes them, which would change the hash of the later pages.
+        # Empty if the page cannot be fingerprinted, so it is mined again.
+        document_pages = list(document_pages)
+        page_hashes = [page_fingerprint(page) or "" for page in document_pages]
+
+    for page_num, page in enumerate(document_pages, start=1):
+        page_hash = page_hashes[page_num - 1] if page_hashes else ""
+        previous = previous_by_hash.get(page_hash) if page_hash else None
+
+        if previous:
+            # Page is unchanged, but it may have moved
+            filtered = [Line(page_num, l.line_number, l.start_position, l.text)
+                        for l in previous.lines]
+            logger.debug(
+                f"Page {page_num} unchanged, reusing {len(filtered)} lines.")
+        else:
+            filtered = _mine_page(interpreter, device, page, page_num,
+                                  left_margin=left_margin, bottom_margin=bottom_margin)
+
+        if pages is not None:
+            pages.append(PageRecord(page_num, page_hash, filtered))
+
+        yield filtered
 
-        page_num = layout.pageid
-        media_box = page.mediabox
 
-        width: float = page.mediabox[2]
-        height: float = page.mediabox[3]
+def _mine_page(
+    interpreter: PDFPageInterpreter,
+    device: PDFPageAggregator,
+    page: PDFPage,
+    page_num: int,
+    left_margin: float = 0,
+    bottom_margin: float = 0,
+) -> List[Line]:
+    """Interpret a single page and return its transcript lines"""
+
+    interpreter.process_page(page)
+    # receive the LTPage object for the page.
+    layout = device.get_result()
+    # print("Layout: " + str(layout.pageid))  # Actual Page ID, 1 based
+    # print("Page: " + str(page.pageid))
 
-        # print(f"media_box: {media_box}, width: {width}, height: {height}")
+    media_box = page.mediabox
 
-        elements_on_page: List[TextElement] = list()
+    width: float = page.mediabox[2]
+    height: float = page.mediabox[3]
 
-        for element in layout:
-            # print(element)
-            # Only use LTTextBoxHorizontal Elements
-            if isinstance(element, LTTextBoxHorizontal):
+    # print(f"media_box: {media_box}, width: {width}, height: {height}")
 
-                bbox = element.bbox
-                text = element.get_text()
+    elements_on_page: List[TextElement] = list()
 
-                # x0: the distance from the left of the page to the left edge of the box.
-                # y0: the distance from the bottom of the page to the lower edge of the box.
-                # x1: the distance from the left of the page to the right edge of the box.
-                # y1: the distance from the bottom of the page to the upper edge of the box.
+    for element in layout:
+        # print(element)
+        # Only use LTTextBoxHorizontal Elements
+        if isinstance(element, LTTextBoxHorizontal):
 
-                if bbox[0] > left_margin:  # Greater than Left Margin
-                    if bbox[1] > bottom_margin:  # Above Bottom Margin
-                        newElement = TextElement(page_num, element.bbox, text)
-                        logger.debug(f"Append TextElement: {newElement}")
+            bbox = element.bbox
+            text = element.get_text()
 
-                        elements_on_page.append(newElement)
-                    else:
-                        logger.warn(
-                            f"Text Elements Below Bottom Margin: {text}")
+            # x0: the distance from the left of the page to the left edge of the box.
+            # y0: the distance from the bottom of the page to the lower edge of the box.
+            # x1: the distance from the left of the page to the right edge of the box.
+            # y1: the distance from the bottom of the page to the upper edge of the box.
 
+            if bbox[0] > left_margin:  # Greater than Left Margin
+                if bbox[1] > bottom_margin:  # Above Bottom Margin
+                    elements_on_page.append(
+                        TextElement(page_num, bbox, text))
                 else:
-                    logger.warn(f"Text Element outside Left Margin: {text}")
+                    logger.warn(
+                        f"Text Elements Below Bottom Margin: {text}")
 
-        # print(f"Elements on Page:  {len(elements_on_page)}")
-        _sortElements_on_page(elements_on_page)
-        lines = _convert_elements_on_page_into_lines(elements_on_page)
-        # print(f"Lines Extracted: {len(lines)}")
-        filtered = _filter_lines(lines, width)
-        # print(f"Filtered Lines: {len(filtered)}")
-        transcript_lines.extend(filtered)
+            else:
+                logger.warn(f"Text Element outside Left Margin: {text}")
 
-    # for l in transcript_lines:
-    #     print(l)
+    # print(f"Elements on Page:  {len(elements_on_page)}")
+    _sortElements_on_page(elements_on_page)
+    lines = _convert_elements_on_page_into_lines(elements_on_page)
+    # print(f"Lines Extracted: {len(lines)}")
+    filtered = _filter_lines(lines, width)
+    # print(f"Filtered Lines: {len(filtered)}")
 
-    return transcript_lines
+    return filtered
 
 
 def _sortElements_on_page(elements: List[TextElement]):
@@ -259,7 +554,8 @@ def _create_line_from_staged_elements(stage: List[TextElement]) -> Line:
         start_position=start_postion,
         text=full_line_text,
     )
-    logger.debug(f"New Line Created: {new_line}")
+    # Formatted lazily, as this runs for every line of every page
+    logger.debug("New Line Created: %s", new_line)
 
     return new_line
 
@@ -267,7 +563,13 @@ def _create_line_from_staged_elements(stage: List[TextElement]) -> Line:
 def _convert_elements_on_page_into_lines(
     elements: List[TextElement], fudge_factor: int = 10
 ) -> List[Line]:
-    """Sort elements on a page into individual lines"""
+    """
+    Sort elements on a page into individual lines.
+
+    The elements must be sorted from the top of the page down. A new line
+    starts where the gap between the tops of two consecutive elements is
+    at least the fudge_factor.
+    """
 
     lines: List[Line] = list()
 
@@ -280,40 +582,27 @@ def _convert_elements_on_page_into_lines(
     filtered_elements = [x for x in elements if x.text.strip()]
 
     for i, e in enumerate(filtered_elements):
-        # logger.info(f"Loop {i},\nStaged Len: {len(stage)}, Element: {e}")
-        # print(f"Loop {i},\nStaged Len: {len(stage)}, Element: {e}")
-
         if i == 0:
             # First loop, we need to set last_top.
-            # print(f"First loop last_top: {e.bbox[3]}")
             last_top = e.bbox[3]
 
         current_top = e.bbox[3]
         difference = last_top - current_top
-        # print(f"Last {last_top} - current {current_top} = Difference: {difference}")
 
-        if difference < fudge_factor:
-            # This is within the fudge factor
-            # This should be considered the same line
-            # print("Same line. Append")
-            stage.append(e)
-        else:
-            new_line = _create_line_from_staged_elements(stage)
-            lines.append(new_line)
-            # Reset our var
-            last_top = current_top
+        if difference >= fudge_factor and stage:
+            # Far enough below the element above it, so a new line
+            lines.append(_create_line_from_staged_elements(stage))
+            stage = list()
 
-            # logger.debug(f"Clearing the current stage.")
-            stage.clear()
-            # This element is the start of the next line
-            stage.append(e)
-        # print(f"End Loop {i} #########")
+        stage.append(e)
+        # Compare with the element above, not the first element on the
+        # line, so a slowly drifting line is not split
+        last_top = current_top
 
     # Final Loop
     if len(stage) > 0:
         # If anything is staged, make a line
-        new_line = _create_line_from_staged_elements(stage)
-        lines.append(new_line)
+        lines.append(_create_line_from_staged_elements(stage))
 
     return lines
 
@@ -0,0 +1,105 @@
+import json
+import logging
+from typing import Dict, List
+
+from miner import Line, PageRecord
+
+logger = logging.getLogger(__name__)
+
+
+# Bump when the way lines are extracted from a page, or the way pages are
+# hashed, changes, so stale page caches are not spliced into new conversions.
+PAGE_CACHE_VERSION = 3
+
+
+def page_cache_to_json(pages: List[PageRecord], params: dict) -> str:
+    """
+    Serialize the page records of a conversion, with the parameters
+    (ie. margins) the lines were extracted with.
+    """
+    cache = {
+        "version": PAGE_CACHE_VERSION,
+        "params": params,
+        "pages": [
+            {
+                "page": p.page,
+                "hash": p.hash,
+                "lines": [[l.line_number, l.start_position, l.text] for l in p.lines],
+            }
+            for p in pages
+        ],
+    }
+    return json.dumps(cache)
+
+
+def page_cache_from_json(text: str, params: dict) -> List[PageRecord] | None:
+    """
+    Returns the page records of a previous conversion, or None if it was
+    extracted with another version or different parameters.
+    """
+    cache = json.loads(text)
+
+    if cache.get("version") != PAGE_CACHE_VERSION:
+        logger.info("Page cache is from another version. Ignoring it.")
+        return None
+
+    if cache.get("params") != params:
+        logger.info(
+            f"Page cache was extracted with different parameters: {cache.get('params')}. Ignoring it.")
+        return None
+
+    pages = list()
+    for p in cache["pages"]:
+        lines = [Line(p["page"], line_number, start_position, text)
+                 for line_number, start_position, text in p["lines"]]
+        pages.append(PageRecord(p["page"], p["hash"], lines))
+
+    return pages
+
+
+def compare_pages(previous: List[PageRecord], current: List[PageRecord]) -> Dict[str, list]:
+    """
+    Compare the pages of two versions of a transcript.
+
+    unchanged: same page number and content
+    moved: [previous page, current page] with the same content
+    changed: same page number, different content
+    added: page numbers that did not exist in the previous version
+    removed: page numbers that no longer exist
+    """
+    previous_by_page = {p.page: p for p in previous}
+    # Pages without a hash could not be fingerprinted, and count as changed
+    previous_by_hash = {p.hash: p for p in previous if p.hash}
+
+    report: Dict[str, list] = {
+        "unchanged": list(),
+        "moved": list(),
+        "changed": list(),
+        "added": list(),
+        "removed": list(),
+    }
+
+    for p in current:
+        old = previous_by_page.get(p.page)
+        if old and p.hash and old.hash == p.hash:
+            report["unchanged"].append(p.page)
+        elif p.hash in previous_by_hash:
+            report["moved"].append([previous_by_hash[p.hash].page, p.page])
+        elif old:
+            report["changed"].append(p.page)
+        else:
+            report["added"].append(p.page)
+
+    current_pages = {p.page for p in current}
+    report["removed"] = [p.page for p in previous if p.page not in current_pages]
+
+    return report
+
+
+def change_report_to_json(report: Dict[str, list]) -> str:
+    summary = {key: len(value) for key, value in report.items()}
+    return json.dumps({"summary": summary, "pages": report}, indent=2)
+
+
+def summarize_changes(report: Dict[str, list]) -> str:
+    return ", ".join(f"{len(value)} {key}" for key, value in report.items())
@@ -0,0 +1,118 @@
+import logging
+import re
+from pathlib import Path
+from typing import IO, List
+
+from miner import Line
+
+logger = logging.getLogger(__name__)
+
+
+# Court reporters deliver ASCII transcripts as .txt or .asc files
+TEXT_SUFFIXES = (".txt", ".TXT", ".asc", ".ASC", ".ascii")
+
+# Capture a numbered transcript line, ie. "12     Q.   Did you see him?"
+numbered_line_regex = re.compile(r"^(\s*)(\d{1,2})(?=\s|$)(.*)$")
+
+
+def _match_numbered_line(text: str, max_number_column: int):
+    """
+    Returns the match for a numbered transcript line. Numbers further
+    right than max_number_column are printed page numbers, not line numbers.
+    """
+    mo = numbered_line_regex.search(text)
+    if mo and len(mo.group(1)) <= max_number_column:
+        return mo
+    return None
+
+
+def is_text_transcript(file_path: Path, sample_lines: int = 100, max_number_column: int = 10) -> bool:
+    """
+    Whether the file is a fixed width ASCII transcript.
+
+    .txt files are only transcripts when most of their first lines start
+    with a line number. This keeps converted outputs, which are also .txt
+    files, from being read as transcripts.
+    """
+    if file_path.suffix not in TEXT_SUFFIXES:
+        return False
+
+    if file_path.suffix.lower() != ".txt":
+        return True
+
+    numbered = 0
+    total = 0
+    with open(file_path, "r", encoding="utf-8", errors="replace") as file:
+        for text in file:
+            text = text.replace("\f", "").rstrip()
+            if not text:
+                continue
+            total += 1
+            if _match_numbered_line(text.expandtabs(8), max_number_column):
+                numbered += 1
+            if total >= sample_lines:
+                break
+
+    return numbered >= 5 and numbered * 2 >= total
+
+
+def ReadTextTranscript(
+    textData: IO[str],
+    char_width: float = 7.2,
+    max_number_column: int = 10,
+) -> List[Line]:
+    """
+    Read the lines of a fixed width ASCII transcript.
+
+    Produces the same Line stream as MinePDFTranscript. The start_position
+    is the column the text starts at, times char_width (10 characters per
+    inch at 72 points per inch), so it is on the same scale as a PDF.
+    A new page starts at a form feed, or when the line numbers start over.
+    Lines without a line number (ie. headers and page numbers) are skipped.
+    """
+    transcript_lines: List[Line] = list()
+
+    page = 1
+    last_line_number = 0
+
+    for raw in textData:
+        raw = raw.rstrip("\r\n")
+
+        if "\f" in raw:
+            # Form feed, a new page
+            if last_line_number > 0:
+                page += 1
+            last_line_number = 0
+            raw = raw.split("\f")[-1]
+
+        text = raw.expandtabs(8)
+        mo = _match_numbered_line(text, max_number_column)
+        if not mo:
+            continue
+
+        line_number = int(mo.group(2))
+        if line_number <= last_line_number:
+            # The line numbers started over, a new page
+            page += 1
+        last_line_number = line_number
+
+        rest = mo.group(3)
+        stripped = rest.lstrip()
+
+        if stripped:
+            column = len(mo.group(1)) + len(mo.group(2)) + \
+                (len(rest) - len(stripped))
+            new_line = Line(page=page, line_number=line_number,
+                            start_position=column * char_width, text=stripped)
+        else:
+            # Empty line. Like the PDF miner, the line number is the text.
+            # Line numbers are right aligned, so use the column of the last
+            # digit, which is the same for every empty line.
+            column = len(mo.group(1)) + len(mo.group(2)) - 1
+            new_line = Line(page=page, line_number=line_number,
+                            start_position=column * char_width, text=mo.group(2))
+
+        logger.debug(f"New Line Created: {new_line}")
+        transcript_lines.append(new_line)
+
+    return transcript_lines